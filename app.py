@@ -1,9 +1,39 @@
 import streamlit as st
-import pandas as pd
-import pypdf
-import pdfplumber
-import re
+import hashlib
 import io
+import json
+import zipfile
+from collections import OrderedDict
+from itertools import chain
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from invoice_engine import (
+    LazyModule,
+    InvoiceCache,
+    LayoutRegistry,
+    ExtractionService,
+    zip_pdf_members,
+    iter_zip_pdfs,
+    prefetch,
+    load_portfolio_mapping,
+    CampaignMatcher,
+    portfolio_content_hash,
+    IncrementalReport,
+    InvoiceStore,
+    build_master_df,
+    BrandCube,
+    PagedView,
+    PAGE_SIZES,
+    export_reports_excel,
+    export_csv,
+    export_parquet,
+    XLSX_MIME,
+    DEFAULT_FILE_TIMEOUT,
+    WARM_WORKERS,
+)
+
+# Imported on first use, so the upload page renders before pandas has loaded
+pd = LazyModule("pandas")
 
 # --- PAGE CONFIG ---
 st.set_page_config(
@@ -12,215 +42,132 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- DATA ENGINEERING LOGIC ---
-
-def clean_campaign_name_final(name_list):
-    """Joins fragments and strictly removes 'Exclusive)' noise."""
-    full_name = " ".join(name_list).strip()
-    
-    # Cleaning patterns for 'Exclusive)' and common PDF noise
-    noise_patterns = [
-        r"\(?Exclusive\)?",              # Removes 'Exclusive)', '(Exclusive)', etc.
-        r"Total amount billed.*INR",
-        r"Total adjustments.*INR",
-        r"Total amount tax included.*INR",
-        r"Portfolio name.*?:",
-        r"Page \d+ of \d+",
-        r"Amazon Seller Services.*",
-        r"8th Floor, Brigade GateWay.*",
-        r"Trade Center, No 26/1.*",
-        r"Dr Raj Kumar Road.*",
-        r"Malleshwaram.*",
-        r"Bangalore, Karnataka.*",
-        r"Summary of Portfolio Charges.*",
-        r"Campaign\s+Campaign Type\s+Clicks.*"
-    ]
-    
-    for pattern in noise_patterns:
-        full_name = re.sub(pattern, "", full_name, flags=re.IGNORECASE)
-    
-    return full_name.replace("  ", " ").strip(" :,\"")
-
-def get_total_amount_from_bottom(pdf_obj):
+# --- RESULT CACHE ---
+
+@st.cache_resource
+def get_invoice_cache():
+    # cache_resource keeps one instance alive across Streamlit reruns
+    return InvoiceCache()
+
+@st.cache_resource
+def get_layout_registry():
+    return LayoutRegistry()
+
+@st.cache_resource(max_entries=8)
+def get_portfolio_matcher(content_hash, file_name, _data):
+    # Keyed by content hash only; the underscore keeps Streamlit from hashing the bytes again
+    mapping = load_portfolio_mapping(io.BytesIO(_data), file_name)
+    return CampaignMatcher(mapping) if mapping is not None else None
+
+@st.cache_resource
+def get_extraction_service():
+    # One per server process: every session's invoices share its bounded worker pool,
+    # which (with INVOICE_WARM_WORKERS) warms in the background while the page renders
+    return ExtractionService(cache=get_invoice_cache(), layouts=get_layout_registry(), warm=WARM_WORKERS)
+
+MAX_EXTRACTION_JOBS = 8
+
+@st.cache_resource
+def get_extraction_jobs():
+    # Process-wide, keyed by the content of the files being parsed, so a browser
+    # refresh that re-uploads the same invoices reattaches to the running job
+    return OrderedDict()
+
+@st.cache_resource
+def get_extraction_watchers():
+    # job key -> ids of the sessions attached to that job
+    return {}
+
+def release_extraction_job(job_key, job, session_id):
+    # Sessions uploading the same files share a job; only the last one attached cancels it
+    watchers = get_extraction_watchers().get(job_key, set())
+    watchers.discard(session_id)
+    if not watchers and job.running:
+        job.cancel()  # Its finished files are cached for whichever job comes next
+
+def iter_archive_files(upload, seen, skipped):
+    # Members are keyed and named under their archive so they never clash with other uploads
+    for member, content_hash, data in iter_zip_pdfs(upload, seen, skipped):
+        yield f"{upload.file_id}/{member}", f"{upload.name}/{member}", content_hash, data
+
+@st.cache_resource
+def get_history_store():
+    return InvoiceStore()
+
+@st.cache_data(max_entries=8)
+def load_history(revision, start, end, mapping_key, compact, _mapping):
+    # revision changes on every ingest, mapping_key when the portfolio changes
+    return build_master_df(get_history_store().query(start, end), _mapping, compact)
+
+# --- REPORT VIEWS ---
+
+def paged_table(key, view_key, make_df):
     """
-    Extracts 'Total Amount (tax included)' from ANY invoice layout.
-    Handles boxes, tables, line breaks, INR before/after value.
+    Searchable, sortable table that sends only the visible page to the browser.
+    make_df() builds the frame; it is called again only when view_key (dataset
+    version plus any filter) changes.
     """
-
-    full_text = ""
-    # Try pypdf first
-    try:
-        for page in pdf_obj.pages:
-            text = page.extract_text()
-            if text:
-                full_text += text + "\n"
-    except Exception:
-        # Fallback if pypdf fails (e.g. KeyError: 'bbox')
-        full_text = ""
-        if hasattr(pdf_obj, 'stream'): # Likely pypdf
-            try:
-                with pdfplumber.open(pdf_obj.stream) as pl_pdf:
-                    for page in pl_pdf.pages:
-                        full_text += page.extract_text() + "\n"
-            except: pass
-        else: # Likely pdfplumber or similar
-            for page in pdf_obj.pages:
-                full_text += (page.extract_text() or "") + "\n"
-
-    # Normalize text
-    flat = (
-        full_text
-        .replace("\n", " ")
-        .replace("\r", " ")
-        .replace(",", "")
-        .lower()
-    )
-
-    patterns = [
-        r"total\s*amount\s*\(tax\s*included\)\s*([\d,]+\.\d{2})",
-        r"total\s*tax\s*included.*?([\d,]+\.\d{2})",
-        r"total\s*amount\s*\(tax\s*included\)\s*inr\s*([\d,]+\.\d{2})",
-        r"total\s*amount.*?tax\s*included.*?([\d,]+\.\d{2})",
-        r"total.*?tax\s*included.*?inr\s*([\d,]+\.\d{2})",
-        r"total\s*amount.*?([\d,]+\.\d{2})"
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, flat, re.IGNORECASE)
-        if match:
-            return float(match.group(1))
-
-    raise ValueError("❌ 'Total Amount (tax included)' not found in invoice")
-
-def process_invoice(pdf_file):
-    # Use bytes for both to avoid re-reading
-    pdf_bytes = pdf_file.read()
-    pdf_file.seek(0)
-    
-    # Try with pypdf first for accuracy
-    try:
-        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
-        final_total = get_total_amount_from_bottom(reader)
-        
-        first_page_text = reader.pages[0].extract_text() or ""
-        first_page_text = first_page_text.replace('\n', ' ')
-        
-        inv_num = re.search(r"Invoice Number\s*[:\s]*(\S+)", first_page_text)
-        inv_date = re.search(r"Invoice Date\s*[:\s]*(\d{2}-\d{2}-\d{4})", first_page_text)
-        
-        meta = {
-            "num": inv_num.group(1).strip() if inv_num else "N/A",
-            "date": inv_date.group(1).strip() if inv_date else "N/A",
-            "total": float(final_total)
-        }
-        
-        rows = []
-        name_accum = []
-        is_table = False
-
-        for page in reader.pages:
-            text = page.extract_text()
-            if not text: continue
-            lines = text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if "Campaign" in line and "Clicks" in line:
-                    is_table = True
-                    name_accum = [] 
-                    continue
-                
-                if not is_table: continue
-
-                metric_match = re.search(r"(SPONSORED\s+(?:PRODUCTS|BRANDS|DISPLAY))\s+(-?\d+)\s+(-?[\d,.]+)(?:\s*INR)?\s+(-?[\d,.]+)(?:\s*INR)?", line, re.IGNORECASE)
-                
-                if metric_match:
-                    name_part = line[:metric_match.start()].strip()
-                    if name_part:
-                        name_accum.append(name_part)
-                    
-                    rows.append({
-                        "Campaign": clean_campaign_name_final(name_accum),
-                        "Campaign Type": metric_match.group(1),
-                        "Clicks": int(metric_match.group(2)),
-                        "Average CPC": float(metric_match.group(3).replace(',', '')),
-                        "Amount": float(metric_match.group(4).replace(',', '')),
-                        "Invoice Number": meta["num"],
-                        "Invoice date": meta["date"],
-                        "Total Amount (tax included)": meta["total"]
-                    })
-                    name_accum = []
-                else:
-                    if any(k in line for k in ["FROM", "Trade Center", "Invoice Number", "Summary"]):
-                        name_accum = []
-                        continue
-                    name_accum.append(line)
-        
-        if not rows:
-            raise ValueError("pypdf returned no data")
-            
-        return rows, "pypdf"
-
-    except Exception as e:
-        # Fallback to pdfplumber
-        pdf_file.seek(0)
-        try:
-            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-                full_text = "\n".join([p.extract_text() or "" for p in pdf.pages])
-                final_total = get_total_amount_from_bottom(pdf)
-                
-                first_page_text = (pdf.pages[0].extract_text() or "").replace('\n', ' ')
-                inv_num = re.search(r"Invoice Number\s*[:\s]*(\S+)", first_page_text)
-                inv_date = re.search(r"Invoice Date\s*[:\s]*(\d{2}-\d{2}-\d{4})", first_page_text)
-                
-                meta = {
-                    "num": inv_num.group(1).strip() if inv_num else "N/A",
-                    "date": inv_date.group(1).strip() if inv_date else "N/A",
-                    "total": float(final_total)
-                }
-                
-                rows = []
-                for page in pdf.pages:
-                    table = page.extract_table()
-                    if not table:
-                        continue
-                    
-                    name_accum = []
-                    
-                    for row in table:
-                        clean_row = [str(cell).strip() if cell else "" for cell in row]
-                        row_str = " ".join(clean_row)
-                        
-                        metric_match = re.search(
-                            r"(SPONSORED\s+(?:PRODUCTS|BRANDS|DISPLAY))\s+(-?\d+)\s+(-?[\d,.]+)(?:\s*INR)?\s+(-?[\d,.]+)(?:\s*INR)?",
-                            row_str, re.IGNORECASE
-                        )
-                        
-                        if metric_match:
-                            possible_name = row_str[:metric_match.start()].strip()
-                            if possible_name:
-                                name_accum.append(possible_name)
-                            
-                            rows.append({
-                                "Campaign": clean_campaign_name_final(name_accum),
-                                "Campaign Type": metric_match.group(1).upper(),
-                                "Clicks": int(metric_match.group(2)),
-                                "Average CPC": float(metric_match.group(3).replace(',', '')),
-                                "Amount": float(metric_match.group(4).replace(',', '')),
-                                "Invoice Number": meta["num"],
-                                "Invoice date": meta["date"],
-                                "Total Amount (tax included)": meta["total"]
-                            })
-                            name_accum = []
-                        else:
-                            if any(k in row_str.upper() for k in ["CAMPAIGN", "CLICKS", "FROM", "TRADE CENTER", "INVOICE NUMBER", "SUMMARY"]):
-                                name_accum = []
-                                continue
-                            if any(c for c in clean_row if c):
-                                name_accum.append(row_str)
-                
-                return rows, ("fallback_success" if rows else "failed")
-        except Exception:
-            return [], "failed"
+    view = st.session_state.get(f"{key}_view")
+    if view is None or view[0] != view_key:
+        view = st.session_state[f"{key}_view"] = (view_key, PagedView(make_df()))
+    view = view[1]
+
+    def first_page():
+        st.session_state[f"{key}_page"] = 1
+
+    col_search, col_sort, col_order, col_size = st.columns([3, 2, 1, 1])
+    search = col_search.text_input("Search", key=f"{key}_search", on_change=first_page,
+                                   placeholder="Campaign, invoice number, brand...")
+    sort_by = col_sort.selectbox("Sort by", ["(upload order)"] + list(view.df.columns), key=f"{key}_sort", on_change=first_page)
+    descending = col_order.toggle("Descending", key=f"{key}_desc", on_change=first_page)
+    page_size = col_size.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_size", on_change=first_page)
+
+    query = (search.strip(), None if sort_by == "(upload order)" else sort_by, not descending)
+    matches = len(view.rows(*query))
+    pages = max(1, -(-matches // page_size))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages  # The data or filter shrank under the current page
+    page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, key=f"{key}_page")
+
+    rows, _ = view.page(page, page_size, *query)
+    start = (page - 1) * page_size
+    st.caption(f"Rows {min(start + 1, matches):,}-{start + len(rows):,} of {matches:,}" + (f" matching '{query[0]}'" if query[0] else ""))
+    st.dataframe(rows, use_container_width=True, height=400)
+
+PIVOT_FORMAT = {
+    'Total Campaigns': '{:,.0f}',
+    'Total Clicks': '{:,.0f}',
+    'Total Amount (excl. GST)': '₹{:,.2f}',
+    'Total Amount (incl. GST)': '₹{:,.2f}'
+}
+
+def gradient_css(values, cmap):
+    """CSS per value, shaded low to high through a matplotlib colormap (like Styler.background_gradient)."""
+    from matplotlib import colormaps
+    from matplotlib.colors import to_hex
+
+    values = pd.to_numeric(values, errors="coerce")
+    low, high = values.min(), values.max()
+    scaled = ((values - low) / (high - low) if high > low else values * 0.0).fillna(0.0)
+    css = []
+    for value, rgba in zip(values, colormaps[cmap](scaled.to_numpy())):
+        if pd.isna(value):
+            css.append("")
+            continue
+        # Light text on dark fills, by relative luminance
+        r, g, b = (c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in rgba[:3])
+        text = "#f1f1f1" if 0.2126 * r + 0.7152 * g + 0.0722 * b < 0.408 else "#000000"
+        css.append(f"background-color: {to_hex(rgba)}; color: {text}")
+    return css
+
+def styled_pivot(pivot_df, view_key):
+    """Pivot Styler whose colour gradient is computed once per view_key, not on every rerun."""
+    cached = st.session_state.get("pivot_style")
+    if cached is None or cached[0] != view_key:
+        css = pd.DataFrame("", index=pivot_df.index, columns=pivot_df.columns)
+        css['Total Amount (incl. GST)'] = gradient_css(pivot_df['Total Amount (incl. GST)'], 'YlOrRd')
+        cached = st.session_state["pivot_style"] = (view_key, css)
+    return pivot_df.style.format(PIVOT_FORMAT).apply(lambda _: cached[1], axis=None)
 
 # --- STREAMLIT UI ---
 st.title("📊 Invoice Data Extractor (Amazon Support Advertisment)")
@@ -234,344 +181,517 @@ with col1:
     st.subheader("📁 Step 1: Upload Invoice PDFs")
     uploaded_files = st.file_uploader(
         "Upload all PDF Invoices", 
-        type="pdf", 
+        type=["pdf", "zip"], 
         accept_multiple_files=True,
-        help="Upload one or more invoice PDF files"
+        help="Upload one or more invoice PDF files, or ZIP archives of them"
     )
 
 with col2:
     st.subheader("📋 Step 2: Upload Portfolio Report")
     portfolio_file = st.file_uploader(
-        "Upload Portfolio Report (Excel with Campaign & Brand Columns)",
-        type=["xlsx", "xls"],
-        help="Excel file containing campaign to brand mapping"
+        "Upload Portfolio Report (Excel, CSV or Parquet with Campaign & Brand Columns)",
+        type=["xlsx", "xls", "csv", "parquet"],
+        help="File containing campaign to brand mapping; CSV/Parquet load fastest"
     )
 
+# Started once per server; parser processes warm up while the user picks files
+extraction_service = get_extraction_service()
+
+# Processing options
+st.sidebar.header("⚙️ Processing Options")
+service_metrics = extraction_service.metrics()
+queue_col, parsing_col = st.sidebar.columns(2)
+queue_col.metric("Queued Files", service_metrics["queued"], help="Invoices waiting in the shared extraction queue, all users")
+parsing_col.metric("Parsing", f"{service_metrics['in_flight']}/{service_metrics['workers']}", help="Invoices being parsed / parser processes")
+st.sidebar.caption(
+    f"🏭 Extraction is shared by everyone on this server ({service_metrics['sessions']} session(s) queued, "
+    f"{service_metrics['shared']} duplicate upload(s) parsed once). Files time out after {DEFAULT_FILE_TIMEOUT}s; "
+    "invoices that do not reconcile are re-parsed with pdfplumber."
+)
+low_memory = st.sidebar.checkbox(
+    "Low-memory Mode",
+    value=False,
+    help="Keeps reports in compact column types (categories, parsed dates) for very large batches"
+)
+
+# History store options
+st.sidebar.header("🗄️ Invoice History")
+history_store = get_history_store()
+history_invoices, history_rows, history_first, history_last = history_store.summary()
+# Keyed and set through session state, so ingests (which change the counts) never reset the choice;
+# it only switches to the uploads by itself when the first files are added
+if "data_source" not in st.session_state or (uploaded_files and not st.session_state.get("had_uploads")):
+    st.session_state["data_source"] = "History Store" if history_invoices and not uploaded_files else "Uploaded PDFs"
+st.session_state["had_uploads"] = bool(uploaded_files)
+data_source = st.sidebar.radio(
+    "Data Source",
+    ["Uploaded PDFs", "History Store"],
+    key="data_source",
+    help="Report on the uploaded PDFs, or on invoices saved to the history store"
+)
+st.sidebar.caption(f"History holds {history_invoices:,} invoices ({history_rows:,} campaign rows)")
+save_history = st.sidebar.checkbox(
+    "Save processed invoices to history",
+    value=True,
+    help="Invoices already in the history (same file or Invoice Number) are skipped"
+)
+
 st.markdown("---")
 
-if uploaded_files:
-    combined_data = []
-    status_history = []
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Process all invoices
-    for i, f in enumerate(uploaded_files):
-        status_text.text(f"Processing ({i+1}/{len(uploaded_files)}): {f.name}")
-        rows, method = process_invoice(f)
-        combined_data.extend(rows)
-        status_history.append({"File": f.name, "Status": method, "Rows": len(rows)})
-        progress_bar.progress((i + 1) / len(uploaded_files))
-    
-    status_text.text("✅ Processing Complete!")
-    
+# Add Brand using Portfolio Report
+mapping = None
+mapping_key = None
+if portfolio_file:
+    try:
+        portfolio_bytes = portfolio_file.getvalue()
+        portfolio_hash = portfolio_content_hash(portfolio_bytes)
+        mapping = get_portfolio_matcher(portfolio_hash, portfolio_file.name, portfolio_bytes)
+        if mapping is None:
+            st.error("❌ Could not detect Portfolio or Brand column in uploaded file.")
+        else:
+            mapping_key = portfolio_hash
+    except Exception as e:
+        st.error(f"❌ Portfolio file processing failed: {str(e)}")
+
+df = None
+waiting = False  # Background extraction still has invoices to deliver
+if data_source == "History Store":
+    if not history_invoices:
+        st.info("🗄️ The history store is empty. Process some invoices with 'Save processed invoices to history' on.")
+    else:
+        if "history_range" not in st.session_state:
+            # Defaults to everything stored; later ingests leave the chosen range alone
+            st.session_state["history_range"] = (history_first, history_last) if history_first else ()
+        date_range = st.date_input(
+            "Invoice Date Range",
+            key="history_range",
+            help="Invoices dated within this range (inclusive) are loaded from the history store"
+        )
+        start, end = (tuple(date_range) + (None, None))[:2]
+        df = load_history(history_invoices, start, end, mapping_key, low_memory, mapping)
+        file_count = history_invoices
+        data_version = ("history", history_invoices, start, end, mapping_key, low_memory)
+        # Aggregates are built once per loaded range, not on every filter change
+        history_cube = st.session_state.get("history_cube")
+        if history_cube is None or history_cube[0] != data_version:
+            history_cube = st.session_state["history_cube"] = (data_version, BrandCube.from_frame(df))
+        cube = history_cube[1]
+        reconcile_report = lambda: history_store.reconciliation(start, end)
+        st.caption(f"🗄️ {len(df):,} campaign rows loaded from the history store")
+
+elif uploaded_files:
+    # Per-session report: only files not seen in this session are parsed
+    session_report = st.session_state.get("invoice_report")
+    if session_report is None or session_report.compact != low_memory:
+        session_report = st.session_state["invoice_report"] = IncrementalReport(compact=low_memory)
+    # ZIP archives are streamed member by member by the extraction job
+    archive_uploads = [f for f in uploaded_files if f.name.lower().endswith(".zip")]
+    archive_ids = {f.file_id for f in archive_uploads}
+    session_report.archives = {k: v for k, v in session_report.archives.items() if k in archive_ids}
+    archives = [f for f in archive_uploads if f.file_id not in session_report.archives]
+    # getbuffer() is a view over the upload, so no second copy of every PDF is held
+    pending = session_report.pending([(f.file_id, f.name, f.getbuffer()) for f in uploaded_files if f.file_id not in archive_ids])
+    layout_registry = get_layout_registry()
+
+    # Newly added invoices are parsed by a background job; reruns pick up what has finished
+    job = None
+    remaining = []
+    cancelled = False
+    queue_full = False
+    if pending or archives:
+        # Keyed on the whole upload set, not on what is still pending, so the key holds while
+        # results come in and a refreshed browser finds the same job; only the submit skips finished files
+        pending_hashes = {key: content_hash for key, _, _, content_hash in pending}
+        upload_hashes = [
+            pending_hashes[f.file_id] if f.file_id in pending_hashes else session_report.entries[f.file_id]["hash"]
+            for f in uploaded_files if f.file_id not in archive_ids
+        ]
+        job_key = hashlib.sha1("".join(sorted(upload_hashes) + sorted(archive_ids)).encode("utf-8")).hexdigest()
+        jobs = get_extraction_jobs()
+        job = jobs.get(job_key)
+        session_id = get_script_run_ctx().session_id
+
+        previous_key, previous = st.session_state.get("extraction_job", (None, None))
+        if previous is not None and previous_key != job_key:
+            release_extraction_job(previous_key, previous, session_id)  # Upload set changed
+
+        cancelled = st.session_state.get("extraction_cancelled") == job_key
+        if not cancelled and (job is None or job.state in ("cancelled", "failed")):
+            job = None
+            # Starts fresh or resumes: files finished by an earlier job come back from the cache
+            files = [(key, name, content_hash, data) for key, name, data, content_hash in pending]
+            total = len(files)
+            seen = {content_hash for _, _, _, content_hash in pending}
+            skipped = {}
+            for f in archives:
+                # Read in place: Streamlit hands out a fresh UploadedFile on every rerun,
+                # so this run's object is the job's alone and no copy of the archive is made
+                try:
+                    members = zip_pdf_members(f)
+                except zipfile.BadZipFile:
+                    st.error(f"❌ {f.name} is not a readable ZIP archive.")
+                    session_report.archives[f.file_id] = ([], [("", "unreadable")])
+                    continue
+                if not members:
+                    # Nothing to parse: note what was skipped now rather than queue an empty job
+                    session_report.archives[f.file_id] = ([], [])
+                    for _ in iter_zip_pdfs(f, set(), session_report.archives[f.file_id][1]):
+                        pass
+                    continue
+                total += len(members)
+                skipped[f.file_id] = []
+                files = chain(files, iter_archive_files(f, seen, skipped[f.file_id]))
+            # Backpressure: while the shared queue is full, wait instead of adding to it
+            queue_full = bool(total) and not extraction_service.accepts(total)
+            if total and not queue_full:
+                job = extraction_service.submit(
+                    session_id,
+                    # Reading ahead overlaps inflating the next member with parsing
+                    prefetch(files) if skipped else files,
+                    total=total,
+                    skipped=skipped
+                )
+                jobs[job_key] = job
+                stale = [k for k, j in jobs.items() if not j.running]
+                for stale_key in stale[:max(0, len(jobs) - MAX_EXTRACTION_JOBS)]:
+                    del jobs[stale_key]
+                    get_extraction_watchers().pop(stale_key, None)
+        if job is not None and not cancelled:
+            get_extraction_watchers().setdefault(job_key, set()).add(session_id)
+        st.session_state["extraction_job"] = (job_key, job)
+
+        finished = job.take() if job is not None else {}
+        # Uploaded PDFs are matched by content, so a job started by another session (or
+        # before a refresh) is shared; archive members carry this session's keys
+        # (identical PDFs in one upload all take the same result)
+        pending_keys = {}
+        for key, name, _, content_hash in pending:
+            pending_keys.setdefault(content_hash, []).append((key, name))
+        for key, (name, content_hash, rows, method, meta) in finished.items():
+            if content_hash in pending_keys:
+                targets = pending_keys.pop(content_hash)
+            elif key.split("/", 1)[0] not in archive_ids or key in session_report.entries:
+                continue
+            else:
+                targets = [(key, name)]
+            for key, name in targets:
+                session_report.add(key, name, content_hash, rows, method, meta)
+                if save_history:
+                    history_store.ingest(name, content_hash, rows)
+        remaining = [name for targets in pending_keys.values() for _, name in targets]
+        if job is not None and job.state == "done":
+            for f in archives:
+                prefix = f.file_id + "/"
+                members = [k for k in job.keys if k.startswith(prefix)]
+                session_report.archives[f.file_id] = (members, job.skipped.get(f.file_id, []))
+        remaining += [f.name for f in archives if f.file_id not in session_report.archives]
+    extracting = job is not None and job.running and not cancelled
+    waiting = extracting or queue_full or bool(remaining)
+
+    # Master report (GST column, brand mapping, column order) updated by delta
+    upload_keys = []
+    for f in uploaded_files:
+        if f.file_id not in archive_ids:
+            upload_keys.append(f.file_id)
+        elif f.file_id in session_report.archives:
+            upload_keys += session_report.archives[f.file_id][0]
+        elif job is not None:
+            upload_keys += [k for k in job.keys if k.startswith(f.file_id + "/")]
+    df = session_report.sync(upload_keys, mapping, mapping_key)
+    file_count = len(upload_keys)
+    data_version = ("session", session_report.version)
+    cube = session_report.cube() if not df.empty else None
+    status_history = session_report.status()
+    reconcile_report = session_report.reconciliation
+
+    if extracting:
+        @st.fragment(run_every=2)
+        def extraction_progress(job=job, job_key=job_key, seen=job.completed):
+            st.progress(min(job.completed / job.total, 1.0) if job.total else 0.0, text=f"⏳ Processing in the background ({job.completed}/{job.total})...")
+            metrics = extraction_service.metrics()
+            st.caption(
+                f"🏭 Shared queue: {metrics['queued']} file(s) waiting across {metrics['sessions']} session(s), "
+                f"{metrics['in_flight']} parsing on {metrics['workers']} worker(s)"
+            )
+            if st.button("⏹️ Cancel Extraction"):
+                release_extraction_job(job_key, job, get_script_run_ctx().session_id)
+                st.session_state["extraction_cancelled"] = job_key
+                st.rerun()
+            if job.completed > seen or not job.running:
+                st.rerun()  # Refresh the reports with the newly finished invoices
+
+        extraction_progress()
+    elif queue_full:
+        @st.fragment(run_every=2)
+        def extraction_queue_full(total=total):
+            metrics = extraction_service.metrics()
+            st.info(f"⏳ The shared extraction queue is full ({metrics['queued']} files waiting). Your invoices start as soon as it has room.")
+            if extraction_service.accepts(total):
+                st.rerun()
+
+        extraction_queue_full()
+    elif remaining:
+        st.warning(f"⏹️ Extraction stopped with {len(remaining)} invoice(s) or archive(s) left. Finished invoices are kept.")
+        if job is not None and job.state == "failed":
+            st.error(f"❌ Extraction failed: {job.error}")
+        if st.button("▶️ Resume Extraction"):
+            st.session_state.pop("extraction_cancelled", None)
+            st.rerun()
+    else:
+        sources = [row["Source"] for row in status_history]
+        st.success(f"✅ Processing Complete! ({sources.count('newly processed')} new, {sources.count('from session')} from session)")
+
+    archive_skipped = [
+        (f"{f.name}/{member}" if member else f.name, reason)
+        for f in archive_uploads if f.file_id in session_report.archives
+        for member, reason in session_report.archives[f.file_id][1]
+    ]
+    if archive_skipped:
+        with st.expander(f"🗜️ Skipped {len(archive_skipped)} archive entries (not a PDF, duplicate or unreadable)"):
+            st.dataframe(pd.DataFrame(archive_skipped, columns=["Entry", "Reason"]), use_container_width=True, hide_index=True)
+
     # Show processing status
     if status_history:
         with st.expander("📊 View Detailed Processing Report"):
             status_df = pd.DataFrame(status_history)
             st.dataframe(status_df, use_container_width=True)
 
-    if combined_data:
-        df = pd.DataFrame(combined_data)
-        
-        # Add With GST Column
-        df["With GST Amount (18%)"] = df["Amount"] * 1.18
-        
-        # Add Brand using Portfolio Report
-        if portfolio_file:
-            try:
-                portfolio_df = pd.read_excel(portfolio_file)
-
-                # Clean column names
-                portfolio_df.columns = (
-                    portfolio_df.columns
-                    .astype(str)
-                    .str.strip()
-                    .str.replace("\n", " ", regex=False)
-                    .str.replace("\r", " ", regex=False)
+            # Parser dispatch by layout fingerprint
+            batch_layouts = set(status_df["Layout"])
+            layout_rows = [r for r in layout_registry.report() if r["Layout"] in batch_layouts]
+            if layout_rows:
+                st.write("**Parser Dispatch by Layout**")
+                st.dataframe(pd.DataFrame(layout_rows), use_container_width=True)
+
+            # Per-stage timing, slowest files first
+            timing_files, timing_totals = session_report.timings()
+            if timing_files:
+                st.write("**Stage Timing (batch totals)**")
+                st.dataframe(pd.DataFrame([timing_totals]), use_container_width=True, hide_index=True)
+                st.write("**Slowest Files**")
+                st.dataframe(pd.DataFrame(timing_files[:20]), use_container_width=True, hide_index=True)
+                st.download_button(
+                    label="📥 Download Timing (JSON)",
+                    data=json.dumps({"totals": timing_totals, "files": timing_files}, indent=2),
+                    file_name="invoice_timing.json",
+                    mime="application/json"
                 )
 
-                # Detect required columns
-                portfolio_col = None
-                brand_col = None
-                name_col = None
-
-                for col in portfolio_df.columns:
-                    col_lower = col.lower()
-                    if "portfolio" in col_lower:
-                        portfolio_col = col
-                    elif "brand" in col_lower:
-                        brand_col = col
-                    elif col_lower == "name" or col_lower.endswith(" name"):
-                        name_col = col
-
-                if portfolio_col and brand_col:
-                    # Rename dynamically
-                    rename_dict = {
-                        portfolio_col: "Campaign",
-                        brand_col: "Brand"
-                    }
-
-                    if name_col:
-                        rename_dict[name_col] = "Name"
-
-                    portfolio_df = portfolio_df.rename(columns=rename_dict)
-
-                    # Clean text for matching
-                    def clean_text(x):
-                        return str(x).lower().strip()
-
-                    df["Campaign_clean"] = df["Campaign"].apply(clean_text)
-                    portfolio_df["Campaign_clean"] = portfolio_df["Campaign"].apply(clean_text)
-
-                    # Keep only Brand & Name
-                    keep_cols = ["Campaign_clean", "Brand"]
-                    if "Name" in portfolio_df.columns:
-                        keep_cols.append("Name")
-
-                    portfolio_df = portfolio_df[keep_cols]
-                    portfolio_df = portfolio_df.drop_duplicates("Campaign_clean")
-
-                    # Merge
-                    df = df.merge(
-                        portfolio_df,
-                        on="Campaign_clean",
-                        how="left"
-                    )
-
-                    # Remove helper column
-                    df.drop(columns=["Campaign_clean"], inplace=True)
-                    
-                    st.success(f"✅ Portfolio mapping complete! {len(df[df['Brand'].notna()])} campaigns matched with brands.")
-
-                    # Show unmatched
-                    unmatched = df[df["Brand"].isna()]
-                    if not unmatched.empty:
-                        st.warning(f"⚠️ {len(unmatched)} campaigns not matched with brands.")
-                        with st.expander("View Unmatched Campaigns"):
-                            st.dataframe(unmatched[["Campaign"]].drop_duplicates())
-
-                else:
-                    st.error("❌ Could not detect Portfolio or Brand column in uploaded file.")
-
-            except Exception as e:
-                st.error(f"❌ Portfolio file processing failed: {str(e)}")
-
-        # Final column arrangement
-        cols = ["Campaign", "Campaign Type", "Clicks", "Average CPC", "Amount", 
-                "Invoice Number", "Invoice date", "Total Amount (tax included)", 
-                "With GST Amount (18%)", "Brand", "Name"]
-        df = df[[c for c in cols if c in df.columns]]
-        
-        # Sidebar for brand selection
-        st.sidebar.header("🎯 Filter Options")
-        
-        if "Brand" in df.columns:
-            brands = sorted(df["Brand"].dropna().unique().tolist())
-            selected_brands = st.sidebar.multiselect(
-                "Select Brand(s)",
-                options=brands,
-                default=brands,
-                help="Select one or more brands to filter the data"
-            )
-        else:
-            selected_brands = []
+if df is not None and not df.empty:
+    if mapping is not None:
+        tier_counts = df["Match Tier"].value_counts()
+        tier_text = ", ".join(f"{tier}: {count}" for tier, count in tier_counts.items())
+        st.success(f"✅ Portfolio mapping complete! {len(df[df['Brand'].notna()])} campaigns matched with brands ({tier_text}).")
+
+        # Show fuzzy matches for review
+        fuzzy = df[df["Match Tier"] == "fuzzy"]
+        if not fuzzy.empty:
+            with st.expander(f"Review Fuzzy Matches ({fuzzy['Campaign'].nunique()})"):
+                st.dataframe(fuzzy[["Campaign", "Brand"]].drop_duplicates())
+
+        # Show unmatched
+        unmatched = df[df["Brand"].isna()]
+        if not unmatched.empty:
+            st.warning(f"⚠️ {len(unmatched)} campaigns not matched with brands.")
+            with st.expander("View Unmatched Campaigns"):
+                st.dataframe(unmatched[["Campaign"]].drop_duplicates())
+    
+    # Campaign amounts x 1.18 against each file's extracted total, once per dataset
+    reconciliation = st.session_state.get("reconciliation")
+    if reconciliation is None or reconciliation[0] != data_version:
+        reconciliation = st.session_state["reconciliation"] = (data_version, reconcile_report())
+    mismatched = reconciliation[1][reconciliation[1]["Status"] != "ok"]
+    if not mismatched.empty:
+        st.warning(f"⚠️ {len(mismatched)} invoice(s) do not reconcile: campaign amounts x 1.18 differ from the invoice total.")
+        with st.expander("View Unreconciled Invoices"):
+            st.dataframe(mismatched, use_container_width=True, hide_index=True)
+
+    # Sidebar for brand selection
+    st.sidebar.header("🎯 Filter Options")
+    
+    if "Brand" in df.columns:
+        brands = cube.brands()
+        selected_brands = st.sidebar.multiselect(
+            "Select Brand(s)",
+            options=brands,
+            default=brands,
+            help="Select one or more brands to filter the data"
+        )
+    else:
+        selected_brands = []
+    
+    # Create tabs for 3 reports
+    tab1, tab2, tab3 = st.tabs(["📋 Master Report", "🔍 Brand Filtered Report", "📊 Pivot Table Report"])
+    
+    # ============= TAB 1: MASTER REPORT =============
+    with tab1:
+        st.header("Master Report - All Invoices")
+        st.write(f"**Total Records:** {len(df)}")
+        st.write(f"**Total Files Processed:** {file_count}")
         
-        # Create tabs for 3 reports
-        tab1, tab2, tab3 = st.tabs(["📋 Master Report", "🔍 Brand Filtered Report", "📊 Pivot Table Report"])
+        # Summary metrics (from the brand cube)
+        totals = cube.metrics()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Total Campaigns", totals["Campaigns"])
+        with col2:
+            st.metric("Total Clicks", f"{totals['Clicks']:,}")
+        with col3:
+            st.metric("Total Amount", f"₹{totals['Amount']:,.2f}")
+        with col4:
+            st.metric("With GST", f"₹{totals['With GST']:,.2f}")
         
-        # Helper function for Excel download
-        @st.cache_data
-        def convert_df_to_excel(dataframe, sheet_name='Report'):
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                dataframe.to_excel(writer, index=False, sheet_name=sheet_name)
-            return output.getvalue()
+        # Display data (one page at a time)
+        paged_table("master", data_version, lambda: df)
+    
+    # ============= TAB 2: BRAND FILTERED REPORT =============
+    with tab2:
+        st.header("Brand Filtered Report")
         
-        # ============= TAB 1: MASTER REPORT =============
-        with tab1:
-            st.header("Master Report - All Invoices")
-            st.write(f"**Total Records:** {len(df)}")
-            st.write(f"**Total Files Processed:** {len(uploaded_files)}")
+        if "Brand" in df.columns and selected_brands:
+            # Rows are only filtered when the selection changes and excludes some brands
+            selected_totals = cube.metrics(selected_brands)
+            everything = selected_totals["Records"] == totals["Records"]
+            
+            st.write(f"**Selected Brands:** {', '.join(selected_brands)}")
+            st.write(f"**Filtered Records:** {selected_totals['Records']}")
             
-            # Summary metrics
+            # Summary metrics (from the brand cube)
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("Total Campaigns", df["Campaign"].nunique())
+                st.metric("Campaigns", selected_totals["Campaigns"])
             with col2:
-                st.metric("Total Clicks", f"{df['Clicks'].sum():,}")
+                st.metric("Total Clicks", f"{selected_totals['Clicks']:,}")
             with col3:
-                st.metric("Total Amount", f"₹{df['Amount'].sum():,.2f}")
+                st.metric("Total Amount", f"₹{selected_totals['Amount']:,.2f}")
             with col4:
-                st.metric("With GST", f"₹{df['With GST Amount (18%)'].sum():,.2f}")
+                st.metric("With GST", f"₹{selected_totals['With GST']:,.2f}")
             
-            # Display data
-            st.dataframe(df, use_container_width=True, height=400)
-            
-            # Download button
-            excel_data = convert_df_to_excel(df, 'Master Report')
-            st.download_button(
-                label="📥 Download Master Report (Excel)",
-                data=excel_data,
-                file_name="invoice_master_report.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            # Display filtered data (one page at a time)
+            paged_table(
+                "filtered",
+                (data_version, sorted(selected_brands)),
+                lambda: df if everything else df[df['Brand'].isin(selected_brands)]
             )
+        elif "Brand" not in df.columns:
+            st.warning("⚠️ Please upload a Portfolio Report to enable brand filtering.")
+        else:
+            st.warning("⚠️ Please select at least one brand from the sidebar.")
+    
+    # ============= TAB 3: PIVOT TABLE REPORT =============
+    with tab3:
+        st.header("Pivot Table Report - Brand Summary")
         
-        # ============= TAB 2: BRAND FILTERED REPORT =============
-        with tab2:
-            st.header("Brand Filtered Report")
+        if "Brand" in df.columns:
+            # Create pivot table (restricted to selected brands if any)
+            pivot_df = cube.pivot(selected_brands)
             
-            if "Brand" in df.columns and selected_brands:
-                # Filter data
-                filtered_df = df[df['Brand'].isin(selected_brands)].copy()
-                
-                st.write(f"**Selected Brands:** {', '.join(selected_brands)}")
-                st.write(f"**Filtered Records:** {len(filtered_df)}")
-                
-                # Summary metrics
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("Campaigns", filtered_df["Campaign"].nunique())
-                with col2:
-                    st.metric("Total Clicks", f"{filtered_df['Clicks'].sum():,}")
-                with col3:
-                    st.metric("Total Amount", f"₹{filtered_df['Amount'].sum():,.2f}")
-                with col4:
-                    st.metric("With GST", f"₹{filtered_df['With GST Amount (18%)'].sum():,.2f}")
-                
-                # Display filtered data
-                st.dataframe(filtered_df, use_container_width=True, height=400)
-                
-                # Download button
-                filtered_excel = convert_df_to_excel(filtered_df, 'Filtered Report')
-                st.download_button(
-                    label="📥 Download Filtered Report (Excel)",
-                    data=filtered_excel,
-                    file_name=f"invoice_filtered_{'_'.join(selected_brands[:3])}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-            elif "Brand" not in df.columns:
-                st.warning("⚠️ Please upload a Portfolio Report to enable brand filtering.")
-            else:
-                st.warning("⚠️ Please select at least one brand from the sidebar.")
-        
-        # ============= TAB 3: PIVOT TABLE REPORT =============
-        with tab3:
-            st.header("Pivot Table Report - Brand Summary")
+            # Display pivot table
+            st.dataframe(
+                styled_pivot(pivot_df, (data_version, sorted(selected_brands))),
+                use_container_width=True,
+                height=400
+            )
             
-            if "Brand" in df.columns:
-                # Filter data if brands selected
-                if selected_brands:
-                    pivot_source_df = df[df['Brand'].isin(selected_brands)].copy()
-                else:
-                    pivot_source_df = df.copy()
-                
-                # Create pivot table
-                pivot_df = (
-                    pivot_source_df.groupby("Brand", dropna=False)
-                    .agg({
-                        "Campaign": "count",
-                        "Clicks": "sum",
-                        "Amount": "sum",
-                        "With GST Amount (18%)": "sum"
-                    })
-                    .reset_index()
-                    .rename(columns={
-                        "Campaign": "Total Campaigns",
-                        "Clicks": "Total Clicks",
-                        "Amount": "Total Amount (excl. GST)",
-                        "With GST Amount (18%)": "Total Amount (incl. GST)"
-                    })
-                )
-                
-                # Sort by total amount
-                pivot_df = pivot_df.sort_values("Total Amount (incl. GST)", ascending=False)
-                
-                # Add Grand Total
-                grand_total = pd.DataFrame({
-                    'Brand': ['Grand Total'],
-                    'Total Campaigns': [pivot_df['Total Campaigns'].sum()],
-                    'Total Clicks': [pivot_df['Total Clicks'].sum()],
-                    'Total Amount (excl. GST)': [pivot_df['Total Amount (excl. GST)'].sum()],
-                    'Total Amount (incl. GST)': [pivot_df['Total Amount (incl. GST)'].sum()]
-                })
-                pivot_df = pd.concat([pivot_df, grand_total], ignore_index=True)
-                
-                # Display pivot table
-                st.dataframe(
-                    pivot_df.style.format({
-                        'Total Campaigns': '{:,.0f}',
-                        'Total Clicks': '{:,.0f}',
-                        'Total Amount (excl. GST)': '₹{:,.2f}',
-                        'Total Amount (incl. GST)': '₹{:,.2f}'
-                    }).background_gradient(
-                        subset=['Total Amount (incl. GST)'], 
-                        cmap='YlOrRd'
-                    ),
-                    use_container_width=True,
-                    height=400
-                )
-                
-                # Visualizations
-                st.subheader("📈 Brand Performance Charts")
-                
-                chart_data = pivot_df[pivot_df['Brand'] != 'Grand Total'].copy()
+            # Visualizations
+            st.subheader("📈 Brand Performance Charts")
+            
+            chart_data = pivot_df[pivot_df['Brand'] != 'Grand Total']
+            
+            if not chart_data.empty:
+                col_a, col_b = st.columns(2)
                 
-                if not chart_data.empty:
-                    col_a, col_b = st.columns(2)
-                    
-                    with col_a:
-                        st.write("**Total Amount by Brand (incl. GST)**")
-                        st.bar_chart(
-                            chart_data.set_index('Brand')['Total Amount (incl. GST)'],
-                            height=300
-                        )
-                    
-                    with col_b:
-                        st.write("**Total Clicks by Brand**")
-                        st.bar_chart(
-                            chart_data.set_index('Brand')['Total Clicks'],
-                            height=300
-                        )
+                with col_a:
+                    st.write("**Total Amount by Brand (incl. GST)**")
+                    st.bar_chart(
+                        chart_data.set_index('Brand')['Total Amount (incl. GST)'],
+                        height=300
+                    )
                 
-                # Download pivot table
-                pivot_excel = convert_df_to_excel(pivot_df, 'Pivot Table')
-                st.download_button(
-                    label="📥 Download Pivot Table (Excel)",
-                    data=pivot_excel,
-                    file_name="invoice_pivot_table.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                with col_b:
+                    st.write("**Total Clicks by Brand**")
+                    st.bar_chart(
+                        chart_data.set_index('Brand')['Total Clicks'],
+                        height=300
+                    )
+        else:
+            st.warning("⚠️ Please upload a Portfolio Report to generate pivot table by brand.")
+
+    # ============= EXPORT =============
+    # Files are only built when asked for, then kept until the data or filter changes
+    st.markdown("---")
+    st.subheader("📥 Export Reports")
+
+    export_key = hashlib.sha1(repr((
+        data_version,
+        sorted(selected_brands)
+    )).encode("utf-8")).hexdigest()
+
+    export_format = st.radio(
+        "Format",
+        ["Excel (Master + Filtered + Pivot)", "CSV (Master)", "Parquet (Master)"],
+        horizontal=True,
+        help="CSV and Parquet are much faster for large master reports"
+    )
+
+    if st.button("⚙️ Prepare Download"):
+        with st.spinner("Building export..."):
+            if export_format.startswith("Excel"):
+                has_brand = "Brand" in df.columns
+                export_data = export_reports_excel(
+                    df,
+                    df[df['Brand'].isin(selected_brands)] if has_brand and selected_brands else None,
+                    cube.pivot(selected_brands) if has_brand else None
                 )
+                export_file = ("invoice_reports.xlsx", XLSX_MIME)
+            elif export_format.startswith("CSV"):
+                export_data = export_csv(df)
+                export_file = ("invoice_master_report.csv", "text/csv")
             else:
-                st.warning("⚠️ Please upload a Portfolio Report to generate pivot table by brand.")
-                
-    else:
-        st.error("❌ No data could be extracted from the uploaded files.")
+                export_data = export_parquet(df)
+                export_file = ("invoice_master_report.parquet", "application/octet-stream")
+        st.session_state["export"] = (export_key, export_format, export_data, export_file)
+
+    prepared = st.session_state.get("export")
+    if prepared and prepared[:2] == (export_key, export_format):
+        _, _, export_data, (file_name, mime) = prepared
+        st.download_button(
+            label=f"📥 Download {file_name}",
+            data=export_data,
+            file_name=file_name,
+            mime=mime
+        )
+            
+elif df is not None and not waiting:
+    st.error("❌ No data could be extracted from the uploaded files." if data_source == "Uploaded PDFs" else "❌ No invoices in the selected date range.")
 
-else:
+elif data_source == "Uploaded PDFs":
     # Instructions
     st.info("👆 Please upload PDF invoice files to get started")
     
     st.markdown("""
     ### Instructions:
     
-    1. **Upload Invoice PDFs**: Upload one or more Amazon invoice PDF files
-    2. **Upload Portfolio Report** (Optional): Excel file containing Campaign and Brand columns for brand mapping
+    1. **Upload Invoice PDFs**: Upload one or more Amazon invoice PDF files, or ZIP archives of them
+    2. **Upload Portfolio Report** (Optional): Excel, CSV or Parquet file containing Campaign and Brand columns for brand mapping
     3. **Process**: The app will extract invoice data and map brands automatically
     4. **View Reports**:
        - **Master Report**: Complete dataset with all invoices
        - **Brand Filtered Report**: Filter by selected brands
        - **Pivot Table Report**: Summary statistics by brand
-    5. **Download**: Each report can be downloaded as Excel
+    5. **Download**: Export all reports as one Excel workbook, or the master report as CSV/Parquet
+    6. **History**: Processed invoices are saved to a local history store; pick "History Store" as the data source to report on a date range without uploading
     
     ### Features:
     - Automatic campaign name cleaning
     - Total amount extraction from invoice summary
     - Brand mapping from portfolio report
     - GST calculation (18%)
+    - Per-invoice reconciliation against the invoice total, with automatic pdfplumber re-parse
     - Multi-brand filtering
     - Comprehensive reporting
+    - Deduplicated invoice history with date range queries
+    - One shared extraction queue for all users: identical uploads are parsed once
     """)
 
 # Footer
@@ -0,0 +1,139 @@
+"""
+End-to-end extraction benchmark on synthetic invoices.
+
+For each batch size, runs process_invoice over the batch in a fresh
+subprocess (so peak RSS is per batch) and reports files/sec, per-stage
+latency percentiles and peak RSS. Run it before and after a parser change
+or a pypdf/pdfplumber upgrade and compare.
+
+    python bench/bench_extract.py --sizes 1 100 1000 --json bench_results.json
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def build_corpus(directory, unique, seed):
+    from generate_invoices import generate_invoice
+
+    paths = []
+    for i in range(unique):
+        path = os.path.join(directory, f"invoice_{seed + i:06d}.pdf")
+        if not os.path.exists(path):
+            pdf_bytes, _ = generate_invoice(seed + i)
+            with open(path, "wb") as fh:
+                fh.write(pdf_bytes)
+        paths.append(path)
+    return paths
+
+def run_batch(corpus_dir, size, stages):
+    """Runs inside the child process. Returns a result dict."""
+    import invoice_engine
+
+    paths = sorted(os.path.join(corpus_dir, p) for p in os.listdir(corpus_dir) if p.endswith(".pdf"))
+    # Stage times come from process_invoice's own StageTimer, so each file is parsed once
+    timings = {stage: [] for stage in invoice_engine.TIMING_STAGES + ["process_invoice"]}
+    rows_total = 0
+    methods = {}
+
+    start = time.perf_counter()
+    for i in range(size):
+        # Cycle the corpus; files are read one at a time like the upload loop does
+        with open(paths[i % len(paths)], "rb") as fh:
+            pdf_file = io.BytesIO(fh.read())
+
+        timer = invoice_engine.StageTimer()
+        t0 = time.perf_counter()
+        rows, method = invoice_engine.process_invoice(pdf_file, timer=timer)
+        timings["process_invoice"].append(time.perf_counter() - t0)
+        rows_total += len(rows)
+        methods[method] = methods.get(method, 0) + 1
+
+        if stages:
+            # Only the stages this file went through (e.g. pdfplumber only on fallback)
+            for stage, seconds in timer.stages.items():
+                timings.setdefault(stage, []).append(seconds)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "size": size,
+        "seconds": sum(timings["process_invoice"]),
+        "wall_seconds": elapsed,
+        "files_per_sec": size / sum(timings["process_invoice"]),
+        "rows": rows_total,
+        "methods": methods,
+        "peak_rss_mb": peak_rss_mb(),
+        "latency_ms": {
+            stage: {f"p{p}": percentile(values, p) * 1e3 for p in (50, 90, 99)}
+            for stage, values in timings.items() if values
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--unique", type=int, default=50, help="Distinct invoices generated; larger batches cycle them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", help="Reuse/keep the generated corpus here (default: temp dir)")
+    parser.add_argument("--no-stages", action="store_true", help="Only time process_invoice end to end")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    parser.add_argument("--_child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._child is not None:
+        print(json.dumps(run_batch(args.corpus_dir, args._child, not args.no_stages)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = args.corpus_dir or tmp
+        os.makedirs(corpus_dir, exist_ok=True)
+        build_corpus(corpus_dir, args.unique, args.seed)
+
+        results = []
+        for size in args.sizes:
+            cmd = [sys.executable, os.path.abspath(__file__), "--_child", str(size), "--corpus-dir", corpus_dir]
+            if args.no_stages:
+                cmd.append("--no-stages")
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            results.append(result)
+
+            rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+            print(f"\n=== {size} invoice(s): {result['files_per_sec']:.1f} files/s, {result['rows']} rows, peak RSS {rss}, methods {result['methods']}")
+            print(f"  {'stage':<16}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+            for stage, lat in result["latency_ms"].items():
+                print(f"  {stage:<16}{lat['p50']:>10.2f}{lat['p90']:>10.2f}{lat['p99']:>10.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
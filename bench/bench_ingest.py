@@ -0,0 +1,100 @@
+"""
+ZIP ingestion benchmark: all members inflated up front vs streamed with read-ahead.
+
+Builds an archive of synthetic invoices (each member made unique so none is
+dropped as a duplicate), then parses it in a fresh subprocess per mode and
+reports time to the first parsed invoice, total time and peak RSS of the
+parent process (parser workers are separate processes).
+
+    python bench/bench_ingest.py --members 2000 --unique 50 --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_extract import build_corpus, peak_rss_mb
+
+MODES = ["eager", "streamed"]
+
+def build_archive(path, corpus, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i in range(members):
+            with open(corpus[i % len(corpus)], "rb") as fh:
+                # A trailing comment changes the hash without changing what is parsed
+                archive.writestr(f"invoices/invoice_{i:06d}.pdf", fh.read() + f"\n% copy {i}\n".encode("ascii"))
+    return os.path.getsize(path)
+
+def run(mode, archive_path, workers):
+    """Runs inside the child process. Returns a result dict."""
+    import invoice_engine
+
+    start = time.perf_counter()
+    items = ((name, data) for name, _, data in invoice_engine.iter_zip_pdfs(archive_path))
+    if mode == "eager":
+        items = list(items)
+    else:
+        items = invoice_engine.prefetch(items)
+
+    first = None
+    files = 0
+    rows = 0
+    for _, file_rows, _, _ in invoice_engine.iter_invoice_batch(items, max_workers=workers):
+        if first is None:
+            first = time.perf_counter() - start
+        files += 1
+        rows += len(file_rows)
+
+    return {
+        "mode": mode,
+        "files": files,
+        "rows": rows,
+        "first_result_s": first,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=1000, help="PDF members in the archive")
+    parser.add_argument("--unique", type=int, default=50, help="Distinct invoices generated; members cycle them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    parser.add_argument("--_child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._child is not None:
+        mode, archive_path = args._child
+        print(json.dumps(run(mode, archive_path, args.workers)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = build_corpus(tmp, args.unique, args.seed)
+        archive_path = os.path.join(tmp, "invoices.zip")
+        size = build_archive(archive_path, corpus, args.members)
+        print(f"Archive: {args.members} members, {size / (1024 * 1024):.1f} MB")
+        print(f"{'mode':<10}{'files':>8}{'first (s)':>11}{'total (s)':>11}{'peak RSS MB':>13}")
+        for mode in MODES:
+            cmd = [sys.executable, os.path.abspath(__file__), "--_child", mode, archive_path, "--workers", str(args.workers)]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            results.append(result)
+            rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "n/a"
+            print(f"{mode:<10}{result['files']:>8}{result['first_result_s']:>11.2f}{result['seconds']:>11.2f}{rss:>13}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
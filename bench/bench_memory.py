@@ -0,0 +1,101 @@
+"""
+Master report memory benchmark: plain vs compact (low-memory mode) frames.
+
+Builds an IncrementalReport from synthetic campaign rows (no PDFs needed)
+in a fresh subprocess per mode and size, so peak RSS is per run, and
+reports the master frame's deep size and the process peak RSS.
+
+    python bench/bench_memory.py --invoices 100 1000 5000 --rows-per-invoice 40
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_extract import peak_rss_mb
+
+def synthetic_rows(invoice, rows_per_invoice, rng):
+    meta = {
+        "Invoice Number": f"IN-ADS-{invoice:06d}",
+        "Invoice date": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2025",
+        "Total Amount (tax included)": round(rng.uniform(1e4, 1e6), 2),
+    }
+    return [
+        {
+            "Campaign": f"Brand{rng.randint(0, 49)} Campaign {rng.randint(0, 999)}",
+            "Campaign Type": rng.choice(["SPONSORED PRODUCTS", "SPONSORED BRANDS", "SPONSORED DISPLAY"]),
+            "Clicks": rng.randint(0, 5000),
+            "Average CPC": round(rng.uniform(1, 40), 2),
+            "Amount": round(rng.uniform(10, 10000), 2),
+            **meta,
+        }
+        for _ in range(rows_per_invoice)
+    ]
+
+def run(mode, invoices, rows_per_invoice, seed):
+    """Runs inside the child process. Returns a result dict."""
+    import pandas as pd
+    import invoice_engine
+
+    rng = random.Random(seed)
+    mapping = pd.DataFrame({
+        "Campaign": [f"Brand{b} Campaign {c}" for b in range(50) for c in range(1000)],
+    })
+    mapping["Brand"] = mapping["Campaign"].str.split().str[0]
+    matcher = invoice_engine.CampaignMatcher(mapping)
+
+    start = time.perf_counter()
+    report = invoice_engine.IncrementalReport(compact=(mode == "compact"))
+    for i in range(invoices):
+        report.add(i, f"invoice_{i}.pdf", str(i), synthetic_rows(i, rows_per_invoice, rng), "pypdf", invoice_engine.empty_meta())
+    master = report.sync(range(invoices), matcher, "portfolio")
+    report.cube().pivot()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "invoices": invoices,
+        "rows": len(master),
+        "seconds": elapsed,
+        "frame_mb": master.memory_usage(deep=True).sum() / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--rows-per-invoice", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    parser.add_argument("--_child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._child is not None:
+        mode, invoices = args._child
+        print(json.dumps(run(mode, int(invoices), args.rows_per_invoice, args.seed)))
+        return
+
+    results = []
+    print(f"{'mode':<10}{'invoices':>10}{'rows':>10}{'seconds':>10}{'frame MB':>10}{'peak RSS MB':>13}")
+    for invoices in args.invoices:
+        for mode in ("plain", "compact"):
+            cmd = [sys.executable, os.path.abspath(__file__), "--_child", mode, str(invoices),
+                   "--rows-per-invoice", str(args.rows_per_invoice), "--seed", str(args.seed)]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            results.append(result)
+            rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "n/a"
+            print(f"{mode:<10}{invoices:>10}{result['rows']:>10}{result['seconds']:>10.2f}{result['frame_mb']:>10.1f}{rss:>13}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
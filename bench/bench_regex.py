@@ -0,0 +1,159 @@
+"""
+Micro-benchmark for the campaign row / name cleaning / total regexes.
+
+Compares the original per-call re.* implementation ("before") with the
+precompiled patterns in invoice_engine ("after") on synthetic page text shaped
+like pypdf output, and checks both produce identical results.
+
+    python bench/bench_regex.py --pages 40 --rows-per-page 25 --repeat 5
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoice_engine
+
+# --- BEFORE: original implementation, kept verbatim for comparison ---
+
+def legacy_clean_campaign_name_final(name_list):
+    full_name = " ".join(name_list).strip()
+    noise_patterns = [
+        r"\(?Exclusive\)?",
+        r"Total amount billed.*INR",
+        r"Total adjustments.*INR",
+        r"Total amount tax included.*INR",
+        r"Portfolio name.*?:",
+        r"Page \d+ of \d+",
+        r"Amazon Seller Services.*",
+        r"8th Floor, Brigade GateWay.*",
+        r"Trade Center, No 26/1.*",
+        r"Dr Raj Kumar Road.*",
+        r"Malleshwaram.*",
+        r"Bangalore, Karnataka.*",
+        r"Summary of Portfolio Charges.*",
+        r"Campaign\s+Campaign Type\s+Clicks.*"
+    ]
+    for pattern in noise_patterns:
+        full_name = re.sub(pattern, "", full_name, flags=re.IGNORECASE)
+    return full_name.replace("  ", " ").strip(" :,\"")
+
+def legacy_parse_campaign_rows(page_texts, meta):
+    rows = []
+    name_accum = []
+    is_table = False
+    for text in page_texts:
+        if not text: continue
+        for line in text.split('\n'):
+            line = line.strip()
+            if "Campaign" in line and "Clicks" in line:
+                is_table = True
+                name_accum = []
+                continue
+            if not is_table: continue
+            metric_match = re.search(r"(SPONSORED\s+(?:PRODUCTS|BRANDS|DISPLAY))\s+(-?\d+)\s+(-?[\d,.]+)(?:\s*INR)?\s+(-?[\d,.]+)(?:\s*INR)?", line, re.IGNORECASE)
+            if metric_match:
+                name_part = line[:metric_match.start()].strip()
+                if name_part:
+                    name_accum.append(name_part)
+                rows.append({
+                    "Campaign": legacy_clean_campaign_name_final(name_accum),
+                    "Campaign Type": metric_match.group(1),
+                    "Clicks": int(metric_match.group(2)),
+                    "Average CPC": float(metric_match.group(3).replace(',', '')),
+                    "Amount": float(metric_match.group(4).replace(',', '')),
+                    "Invoice Number": meta["num"],
+                    "Invoice date": meta["date"],
+                    "Total Amount (tax included)": meta["total"]
+                })
+                name_accum = []
+            else:
+                if any(k in line for k in ["FROM", "Trade Center", "Invoice Number", "Summary"]):
+                    name_accum = []
+                    continue
+                name_accum.append(line)
+    return rows
+
+def legacy_total(page_texts):
+    flat = "\n".join(page_texts).replace("\n", " ").replace("\r", " ").replace(",", "").lower()
+    patterns = [
+        r"total\s*amount\s*\(tax\s*included\)\s*([\d,]+\.\d{2})",
+        r"total\s*tax\s*included.*?([\d,]+\.\d{2})",
+        r"total\s*amount\s*\(tax\s*included\)\s*inr\s*([\d,]+\.\d{2})",
+        r"total\s*amount.*?tax\s*included.*?([\d,]+\.\d{2})",
+        r"total.*?tax\s*included.*?inr\s*([\d,]+\.\d{2})",
+        r"total\s*amount.*?([\d,]+\.\d{2})"
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, flat, re.IGNORECASE)
+        if match:
+            return float(match.group(1))
+    raise ValueError("total not found")
+
+# --- SYNTHETIC PAGE TEXT ---
+
+def make_page_texts(pages, rows_per_page, seed=0):
+    rnd = random.Random(seed)
+    words = ["Auto", "Exact", "Phrase", "Broad", "SP", "SB", "Kitchen", "Steel", "Bottle", "Combo", "Deal", "Retarget"]
+    texts = []
+    for p in range(pages):
+        lines = []
+        if p == 0:
+            lines += [
+                "Amazon Seller Services Private Limited",
+                "8th Floor, Brigade GateWay, Trade Center, No 26/1",
+                "Invoice Number: IN-ADS-001234",
+                "Invoice Date: 01-03-2025",
+                "Summary of Portfolio Charges",
+            ]
+        lines.append("Campaign Campaign Type Clicks Average CPC Amount")
+        for _ in range(rows_per_page):
+            name = f"Brand{rnd.randint(1, 40)} " + " ".join(rnd.choice(words) for _ in range(rnd.randint(2, 6)))
+            metrics = f"SPONSORED {rnd.choice(['PRODUCTS', 'BRANDS', 'DISPLAY'])} {rnd.randint(0, 900)} {rnd.uniform(1, 30):.2f} INR {rnd.uniform(0, 20000):,.2f} INR"
+            if rnd.random() < 0.3:
+                lines.append(name)
+                lines.append("Exclusive) " + metrics)
+            else:
+                lines.append(f"{name} {metrics}")
+        lines.append(f"Page {p + 1} of {pages}")
+        texts.append("\n".join(lines))
+    texts[-1] += "\nTotal amount billed INR 1,00,000.00\nTotal adjustments INR 0.00\nTotal Amount (tax included) INR 1,18,000.00"
+    return texts
+
+def timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--rows-per-page", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = make_page_texts(args.pages, args.rows_per_page)
+    meta = {"num": "IN-ADS-001234", "date": "01-03-2025", "total": 118000.0}
+
+    before, legacy_rows = timeit(lambda: legacy_parse_campaign_rows(texts, meta), args.repeat)
+    after, rows = timeit(lambda: invoice_engine.parse_campaign_rows(texts, meta), args.repeat)
+    assert rows == legacy_rows, "row output differs between implementations"
+
+    total_before, legacy_value = timeit(lambda: legacy_total(texts), args.repeat)
+    total_after, value = timeit(lambda: invoice_engine.get_total_amount_from_bottom(page_texts=texts), args.repeat)
+    assert value == legacy_value, "total differs between implementations"
+
+    n = len(rows)
+    print(f"{args.pages} pages, {n} campaign rows (best of {args.repeat})")
+    print(f"  rows        before: {n / before:>12,.0f} rows/s   after: {n / after:>12,.0f} rows/s   ({before / after:.2f}x)")
+    print(f"  total       before: {total_before * 1e3:>9.3f} ms       after: {total_after * 1e3:>9.3f} ms       ({total_before / total_after:.2f}x)")
+
+if __name__ == "__main__":
+    main()
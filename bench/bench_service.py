@@ -0,0 +1,125 @@
+"""
+Concurrent sessions benchmark: one ExtractionJob per session vs one shared ExtractionService.
+
+Simulates several users uploading the same month's invoices at once. "separate" starts
+an ExtractionJob per session, each with its own pool of --workers processes (what the
+app did before the service); "shared" submits every session to one ExtractionService
+with --workers processes. Both share one fresh on-disk InvoiceCache, as the app does.
+Reports wall time, per-session completion times, how many files were actually parsed,
+how many jobs were started (one per session) and the peak number of parser processes
+alive at once.
+
+    python bench/bench_service.py --sessions 4 --invoices 20 --workers 2 --json service.json
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_extract import build_corpus, peak_rss_mb
+
+def run(mode, corpus_dir, sessions, workers, cache_dir):
+    """Runs inside the child process. Returns a result dict."""
+    import invoice_engine
+
+    files = []
+    for name in sorted(os.listdir(corpus_dir)):
+        data = open(os.path.join(corpus_dir, name), "rb").read()
+        files.append((name, name, hashlib.sha256(data).hexdigest(), data))
+    cache = invoice_engine.InvoiceCache(cache_dir=cache_dir)
+
+    peak = 0
+    sampling = True
+
+    def sample():
+        nonlocal peak
+        while sampling:
+            peak = max(peak, len(multiprocessing.active_children()))
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    if mode == "shared":
+        service = invoice_engine.ExtractionService(cache=cache, max_workers=workers)
+        jobs = [service.submit(f"session-{s}", files) for s in range(sessions)]
+        started = service.metrics()["submitted"]
+    else:
+        jobs = [invoice_engine.ExtractionJob(files, cache=cache, max_workers=workers) for _ in range(sessions)]
+        started = len(jobs)
+    finished = {}
+    while len(finished) < len(jobs):
+        for s, job in enumerate(jobs):
+            if s not in finished and not job.running:
+                finished[s] = time.perf_counter() - start
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    sampling = False
+    sampler.join()
+
+    # A parse shared by several sessions hands all of them the same meta
+    parsed = {
+        id(meta)
+        for job in jobs for _, _, meta in job.results.values()
+        if "cache hit" not in meta["timing"]["branches"]
+    }
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "session_seconds": [finished[s] for s in range(len(jobs))],
+        "parsed": len(parsed),
+        "jobs": started,
+        "peak_processes": peak,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="Users uploading the same invoices at once")
+    parser.add_argument("--invoices", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    parser.add_argument("--_child", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._child is not None:
+        mode, corpus_dir, sessions, workers, cache_dir = args._child
+        print(json.dumps(run(mode, corpus_dir, int(sessions), int(workers), cache_dir)))
+        return
+
+    results = []
+    print(f"{'mode':<10}{'seconds':>10}{'median session':>16}{'parsed':>8}{'jobs':>6}{'peak procs':>12}{'peak RSS MB':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = os.path.join(tmp, "corpus")
+        os.makedirs(corpus_dir)
+        build_corpus(corpus_dir, args.invoices, args.seed)
+        for mode in ("separate", "shared"):
+            cache_dir = tempfile.mkdtemp(dir=tmp)   # Every mode starts with a cold cache
+            cmd = [sys.executable, os.path.abspath(__file__), "--_child", mode, corpus_dir,
+                   str(args.sessions), str(args.workers), cache_dir]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=REPO_DIR).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            results.append(result)
+            rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "n/a"
+            print(f"{mode:<10}{result['seconds']:>10.2f}{statistics.median(result['session_seconds']):>16.2f}"
+                  f"{result['parsed']:>8}{result['jobs']:>6}{result['peak_processes']:>12}{rss:>13}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
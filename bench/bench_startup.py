@@ -0,0 +1,119 @@
+"""
+Cold start benchmark: engine import time, the app's first render, and time to the
+first parsed invoice with a cold vs a pre-warmed worker pool.
+
+Every measurement runs in a fresh interpreter, so imports are never already
+cached in the process. "first render" runs app.py once with no uploads through
+Streamlit's AppTest (streamlit's own import is timed separately); the module
+columns show which heavy libraries that had to load.
+
+    python bench/bench_startup.py --repeat 5 --workers 4 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+HEAVY_MODULES = ["pandas", "pypdf", "pdfplumber", "matplotlib"]
+
+def loaded_modules():
+    # A LazyModule stand-in is not in sys.modules until it is first used
+    return {name: name in sys.modules for name in HEAVY_MODULES}
+
+def child_import():
+    start = time.perf_counter()
+    import invoice_engine  # noqa: F401
+    return {"seconds": time.perf_counter() - start, "modules": loaded_modules()}
+
+def child_render():
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    imported = time.perf_counter()
+    before = loaded_modules()
+    at = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=120)
+    at.run()
+    return {
+        "seconds": time.perf_counter() - imported,
+        "streamlit_import_seconds": imported - start,
+        "exceptions": [e.value for e in at.exception],
+        # Only what the app run itself pulled in, not what AppTest already had
+        "modules": {name: loaded and not before[name] for name, loaded in loaded_modules().items()},
+    }
+
+def child_first_result(corpus_dir, workers, warm):
+    import invoice_engine
+
+    items = [(name, open(os.path.join(corpus_dir, name), "rb").read()) for name in sorted(os.listdir(corpus_dir))]
+    worker_pool = None
+    if warm:
+        worker_pool = invoice_engine.WorkerPool()
+        worker_pool.warm(workers)   # Happens while the user picks files, so it is not timed
+    start = time.perf_counter()
+    batch = invoice_engine.iter_invoice_batch(items, max_workers=workers, worker_pool=worker_pool)
+    next(batch)
+    first = time.perf_counter() - start
+    for _ in batch:
+        pass
+    return {"seconds": first, "batch_seconds": time.perf_counter() - start}
+
+def run_child(*args):
+    cmd = [sys.executable, os.path.abspath(__file__), "--_child", *map(str, args)]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=REPO_DIR).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per measurement (median is reported)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--invoices", type=int, default=8, help="Batch size for the first-result runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    parser.add_argument("--_child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._child is not None:
+        kind, *rest = args._child
+        if kind == "import":
+            result = child_import()
+        elif kind == "render":
+            result = child_render()
+        else:
+            result = child_first_result(rest[0], int(rest[1]), kind == "warm")
+        print(json.dumps(result))
+        return
+
+    from bench_extract import build_corpus
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        build_corpus(tmp, args.invoices, args.seed)
+        runs = {
+            "import": ("import",),
+            "first render": ("render",),
+            "first result (cold pool)": ("cold", tmp, args.workers),
+            "first result (warm pool)": ("warm", tmp, args.workers),
+        }
+        print(f"{'measurement':<28}{'median (s)':>12}{'min (s)':>10}  loaded")
+        for label, child_args in runs.items():
+            samples = [run_child(*child_args) for _ in range(args.repeat)]
+            seconds = [sample["seconds"] for sample in samples]
+            results[label] = {"median": statistics.median(seconds), "min": min(seconds), "samples": samples}
+            modules = samples[-1].get("modules", {})
+            loaded = ", ".join(name for name, hit in modules.items() if hit) or "-"
+            print(f"{label:<28}{statistics.median(seconds):>12.3f}{min(seconds):>10.3f}  {loaded}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Synthetic Amazon advertising invoice generator (offline, matplotlib PDF backend).
+
+Produces PDFs whose extracted text looks like real invoices: header block,
+"Campaign Campaign Type Clicks Average CPC Amount" table header on every page,
+campaign names wrapped over several lines, "Exclusive)" fragments, page
+footers and either total layout (inline or boxed on two lines).
+
+    python bench/generate_invoices.py --count 100 --out-dir bench/corpus
+"""
+import argparse
+import io
+import os
+import random
+
+import matplotlib
+matplotlib.use("pdf")
+matplotlib.rcParams["pdf.fonttype"] = 42  # Embed TrueType so pypdf/pdfplumber can read the text
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+LINES_PER_PAGE = 44
+LINE_HEIGHT = 0.021
+WORDS = ["Auto", "Exact", "Phrase", "Broad", "Kitchen", "Steel", "Bottle", "Combo",
+         "Deal", "Retarget", "Festive", "Defence", "Category", "Video", "Top", "Search"]
+CAMPAIGN_TYPES = ["SPONSORED PRODUCTS", "SPONSORED BRANDS", "SPONSORED DISPLAY"]
+HEADER = [
+    "Amazon Seller Services Private Limited",
+    "8th Floor, Brigade GateWay, Trade Center, No 26/1",
+    "Dr Raj Kumar Road, Malleshwaram",
+    "Bangalore, Karnataka 560055",
+]
+
+def _inr(value):
+    return f"{value:,.2f}"
+
+def _campaign(rnd):
+    name = f"Brand{rnd.randint(1, 25)} " + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 9)))
+    clicks = rnd.randint(0, 2000)
+    cpc = round(rnd.uniform(0.5, 40), 2)
+    return {
+        "Campaign": name,
+        "Campaign Type": rnd.choice(CAMPAIGN_TYPES),
+        "Clicks": clicks,
+        "Average CPC": cpc,
+        "Amount": round(clicks * cpc, 2),
+        "exclusive": rnd.random() < 0.2,
+    }
+
+def _campaign_lines(c, rnd):
+    metrics = f"{c['Campaign Type']} {c['Clicks']} {c['Average CPC']:.2f} INR {_inr(c['Amount'])} INR"
+    words = c["Campaign"].split()
+    if c["exclusive"]:
+        # Real invoices wrap '(Exclusive)' so a bare 'Exclusive)' lands on the metrics line
+        return [" ".join(words), "Exclusive) " + metrics]
+    if len(words) > 5 and rnd.random() < 0.6:
+        cut = rnd.randint(2, len(words) - 2)
+        return [" ".join(words[:cut]), " ".join(words[cut:]) + " " + metrics]
+    return [" ".join(words) + " " + metrics]
+
+def generate_invoice(seed=0, pages=None, campaigns=None, total_layout=None):
+    """
+    Builds one invoice PDF. Returns (pdf_bytes, expected) where expected holds the
+    invoice number, date, total and the campaign rows that should be extracted.
+    """
+    rnd = random.Random(seed)
+    if campaigns is None:
+        # Roughly 20 campaigns fit on a page; `pages` is a target, not exact
+        campaigns = rnd.randint(15, 22) * (pages or rnd.randint(1, 4))
+    total_layout = total_layout or rnd.choice(["inline", "boxed"])
+
+    rows = [_campaign(rnd) for _ in range(campaigns)]
+    billed = round(sum(r["Amount"] for r in rows), 2)
+    total = round(billed * 1.18, 2)
+    inv_num = f"IN-ADS-{seed:08d}"
+    inv_date = f"{rnd.randint(1, 28):02d}-{rnd.randint(1, 12):02d}-2025"
+
+    # Lay the text out as a flat list of lines, then cut into pages
+    body = [[*HEADER, f"Invoice Number: {inv_num}", f"Invoice Date: {inv_date}", "Summary of Portfolio Charges"]]
+    per_page = LINES_PER_PAGE - 2
+    current = body[0]
+    current.append("Campaign Campaign Type Clicks Average CPC Amount")
+    for row in rows:
+        lines = _campaign_lines(row, rnd)
+        if len(current) + len(lines) > per_page:
+            current = ["Campaign Campaign Type Clicks Average CPC Amount"]
+            body.append(current)
+        current.extend(lines)
+
+    totals = [f"Total amount billed INR {_inr(billed)}", "Total adjustments INR 0.00"]
+    if total_layout == "inline":
+        totals.append(f"Total Amount (tax included) INR {_inr(total)}")
+    else:
+        totals += ["Total Amount (tax included)", f"{_inr(total)} INR"]
+    if len(current) + len(totals) > per_page:
+        current = []
+        body.append(current)
+    current.extend(totals)
+
+    buf = io.BytesIO()
+    with PdfPages(buf, metadata={"Producer": "Amazon Invoice Generator (synthetic)"}) as pdf:
+        for p, lines in enumerate(body):
+            fig = plt.figure(figsize=(8.27, 11.69))
+            y = 0.96
+            for line in lines + [f"Page {p + 1} of {len(body)}"]:
+                # Monospace avoids kerning gaps that pypdf would turn into stray spaces
+                fig.text(0.04, y, line, fontsize=7, family="monospace")
+                y -= LINE_HEIGHT
+            pdf.savefig(fig)
+            plt.close(fig)
+
+    expected = {
+        "num": inv_num,
+        "date": inv_date,
+        "total": total,
+        "pages": len(body),
+        "layout": total_layout,
+        "rows": [{k: v for k, v in r.items() if k != "exclusive"} for r in rows],
+    }
+    return buf.getvalue(), expected
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--out-dir", default="bench/corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pages", type=int, help="Approximate pages per invoice (default: random 1-4)")
+    parser.add_argument("--campaigns", type=int, help="Campaigns per invoice (overrides --pages)")
+    parser.add_argument("--layout", choices=["inline", "boxed"], help="Total layout (default: random)")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for i in range(args.count):
+        pdf_bytes, expected = generate_invoice(args.seed + i, pages=args.pages, campaigns=args.campaigns, total_layout=args.layout)
+        path = os.path.join(args.out_dir, f"invoice_{args.seed + i:06d}.pdf")
+        with open(path, "wb") as fh:
+            fh.write(pdf_bytes)
+        print(f"{path}: {expected['pages']} pages, {len(expected['rows'])} campaigns, {expected['layout']} total")
+
+if __name__ == "__main__":
+    main()
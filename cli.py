@@ -0,0 +1,189 @@
+"""
+Headless batch runner for the invoice extractor (no Streamlit needed).
+
+    python cli.py invoices/ "archive/2025-*.pdf" batch.zip --portfolio portfolio.xlsx --brands "Brand A" --out-dir reports/
+
+Files and ZIP members are read one at a time, a few ahead of the parser, and rows
+are appended to the output CSVs invoice by invoice, so memory use stays flat no
+matter how many PDFs are processed.
+"""
+import argparse
+import glob
+import os
+import sys
+import zipfile
+
+import pandas as pd
+
+from invoice_engine import (
+    InvoiceCache,
+    LayoutRegistry,
+    zip_pdf_members,
+    iter_path_pdfs,
+    prefetch,
+    iter_invoice_batch_ordered,
+    load_portfolio_mapping,
+    CampaignMatcher,
+    build_master_df,
+    aggregate_brands,
+    combine_brand_aggregates,
+    finalize_pivot,
+    iter_df_rows,
+    write_excel_workbook,
+    DEFAULT_WORKERS,
+    DEFAULT_FILE_TIMEOUT,
+)
+
+INPUT_EXTENSIONS = (".pdf", ".zip")
+
+def find_pdfs(inputs):
+    """Expands directories and glob patterns into a sorted, de-duplicated list of PDF and ZIP paths."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*"), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.extend(sorted(m for m in matches if m.lower().endswith(INPUT_EXTENSIONS) and os.path.isfile(m)))
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+def count_pdfs(paths):
+    """Upper bound on the invoices in `paths`, read from ZIP directories without inflating anything."""
+    total = 0
+    for path in paths:
+        try:
+            total += len(zip_pdf_members(path)) if path.lower().endswith(".zip") else 1
+        except zipfile.BadZipFile:
+            pass
+    return total
+
+def iter_pdf_items(paths, names, skipped):
+    # Lazily read files so only PDFs currently being parsed are held in memory
+    seen = set()
+    for path in paths:
+        for name, _, pdf_bytes in iter_path_pdfs([path], seen, skipped):
+            names.append(os.path.relpath(name, os.path.dirname(path)))  # "a.pdf" or "batch.zip/a.pdf"
+            yield name, pdf_bytes
+
+def append_csv(df, path, first):
+    df.to_csv(path, mode="w" if first else "a", header=first, index=False)
+
+def csv_sheet(name, path):
+    """(sheet_name, columns, rows) for write_excel_workbook, read back from a CSV in chunks."""
+    columns = list(pd.read_csv(path, nrows=0).columns)
+
+    def rows():
+        for chunk in pd.read_csv(path, chunksize=10000):
+            yield from iter_df_rows(chunk)
+
+    return name, columns, rows()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract Amazon advertising invoice PDFs into Master, Filtered and Pivot reports.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, ZIP archives of PDFs, directories or glob patterns")
+    parser.add_argument("--portfolio", help="Portfolio Report (Excel, CSV or Parquet) with Campaign & Brand columns")
+    parser.add_argument("--brands", nargs="*", default=[], help="Brands for the filtered report and pivot (default: all)")
+    parser.add_argument("--out-dir", default=".", help="Directory for the output CSV files")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parallel parser processes (1 = sequential)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_FILE_TIMEOUT, help="Per-file timeout in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the parse result cache")
+    parser.add_argument("--no-reparse", action="store_true", help="Do not re-parse invoices whose rows do not add up to their total")
+    parser.add_argument("--excel", action="store_true", help="Also write all reports into one .xlsx workbook")
+    args = parser.parse_args(argv)
+
+    paths = find_pdfs(args.inputs)
+    total = count_pdfs(paths)
+    if not total:
+        print("❌ No PDF files found.", file=sys.stderr)
+        return 1
+
+    mapping = None
+    if args.portfolio:
+        mapping = load_portfolio_mapping(args.portfolio)
+        if mapping is None:
+            print("❌ Could not detect Portfolio or Brand column in portfolio file.", file=sys.stderr)
+            return 1
+        # Build the match index once, not per invoice chunk
+        mapping = CampaignMatcher(mapping)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    master_path = os.path.join(args.out_dir, "invoice_master_report.csv")
+    filtered_path = os.path.join(args.out_dir, "invoice_filtered_report.csv")
+    pivot_path = os.path.join(args.out_dir, "invoice_pivot_table.csv")
+
+    cache = None if args.no_cache else InvoiceCache()
+    layouts = None if args.no_cache else LayoutRegistry()
+    partials = []
+    total_rows = 0
+    filtered_rows = 0
+    failed = 0
+    unreconciled = []
+    names = []      # Display name per parsed file, in input order
+    skipped = []    # (path, reason) for non-PDF, duplicate and unreadable inputs
+
+    results = iter_invoice_batch_ordered(
+        # Reading ahead overlaps file reads and ZIP inflation with parsing
+        prefetch(iter_pdf_items(paths, names, skipped)),
+        cache=cache,
+        max_workers=args.workers,
+        timeout=args.timeout,
+        layouts=layouts,
+        reparse=not args.no_reparse
+    )
+    for i, rows, method, meta in results:
+        print(f"[{i + 1}/{total}] {names[i]}: {method} ({len(rows)} rows)", file=sys.stderr)
+        if not rows:
+            failed += 1
+            continue
+        if meta.get("reconciliation") == "mismatch":
+            unreconciled.append((names[i], meta["difference"]))
+
+        chunk = build_master_df(rows, mapping)
+        append_csv(chunk, master_path, total_rows == 0)
+        total_rows += len(chunk)
+
+        if mapping is None:
+            continue
+
+        if args.brands:
+            chunk = chunk[chunk["Brand"].isin(args.brands)]
+            if not chunk.empty:
+                append_csv(chunk, filtered_path, filtered_rows == 0)
+                filtered_rows += len(chunk)
+
+        partials.append(aggregate_brands(chunk))
+        if len(partials) >= 256:
+            # Fold partials so memory does not grow with the number of invoices
+            partials = [combine_brand_aggregates(partials)]
+
+    for path, reason in skipped:
+        print(f"⚠️ Skipped {path}: {reason}", file=sys.stderr)
+    for name, difference in unreconciled:
+        print(f"⚠️ {name} does not reconcile: total differs from amounts x 1.18 by {difference:,.2f}", file=sys.stderr)
+
+    if total_rows == 0:
+        print("❌ No data could be extracted from the input files.", file=sys.stderr)
+        return 1
+
+    print(f"✅ {total_rows} rows from {len(names) - failed}/{len(names)} files -> {master_path}", file=sys.stderr)
+    if filtered_rows:
+        print(f"✅ {filtered_rows} filtered rows -> {filtered_path}", file=sys.stderr)
+    if mapping is not None:
+        finalize_pivot(partials).to_csv(pivot_path, index=False)
+        print(f"✅ Pivot table -> {pivot_path}", file=sys.stderr)
+
+    if args.excel:
+        # Streams the CSVs back row by row, so the workbook never has to fit in memory
+        excel_path = os.path.join(args.out_dir, "invoice_reports.xlsx")
+        sheets = [csv_sheet("Master Report", master_path)]
+        if filtered_rows:
+            sheets.append(csv_sheet("Filtered Report", filtered_path))
+        if mapping is not None:
+            sheets.append(csv_sheet("Pivot Table", pivot_path))
+        write_excel_workbook(excel_path, sheets)
+        print(f"✅ Excel workbook -> {excel_path}", file=sys.stderr)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2429 @@
+"""
+Invoice extraction engine: PDF parsing, result caching, batch processing and
+report building. Has no Streamlit dependency so it can run from the CLI or cron.
+"""
+import re
+import io
+import os
+import csv
+import json
+import time
+import threading
+import hashlib
+import sqlite3
+import queue
+import zipfile
+import importlib
+import signal
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+class LazyModule:
+    """
+    Stands in for a heavy module and imports it on first attribute access, so importing
+    the engine (and so the app's first render) does not pay for pandas or the PDF stack.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            # import_module is thread-safe and returns the sys.modules entry once loaded
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+pypdf = LazyModule("pypdf")
+pdfplumber = LazyModule("pdfplumber")  # Pulls in pdfminer and Pillow
+
+# --- COMPILED PATTERNS ---
+
+# Cleaning patterns for 'Exclusive)' and common PDF noise, as one alternation
+NOISE_RE = re.compile("|".join([
+    r"\(?Exclusive\)?",              # Removes 'Exclusive)', '(Exclusive)', etc.
+    r"Total amount billed.*INR",
+    r"Total adjustments.*INR",
+    r"Total amount tax included.*INR",
+    r"Portfolio name.*?:",
+    r"Page \d+ of \d+",
+    r"Amazon Seller Services.*",
+    r"8th Floor, Brigade GateWay.*",
+    r"Trade Center, No 26/1.*",
+    r"Dr Raj Kumar Road.*",
+    r"Malleshwaram.*",
+    r"Bangalore, Karnataka.*",
+    r"Summary of Portfolio Charges.*",
+    r"Campaign\s+Campaign Type\s+Clicks.*"
+]), re.IGNORECASE)
+
+METRIC_RE = re.compile(
+    r"(SPONSORED\s+(?:PRODUCTS|BRANDS|DISPLAY))\s+(-?\d+)\s+(-?[\d,.]+)(?:\s*INR)?\s+(-?[\d,.]+)(?:\s*INR)?",
+    re.IGNORECASE
+)
+
+CAMPAIGN_TYPE_RE = re.compile(r"SPONSORED\s+(?:PRODUCTS|BRANDS|DISPLAY)", re.IGNORECASE)
+
+LAYOUT_TOKEN_RE = re.compile(r"[A-Za-z]{3,}")
+LAYOUT_TOKENS = 8
+
+INVOICE_NUMBER_RE = re.compile(r"Invoice Number\s*[:\s]*(\S+)")
+INVOICE_DATE_RE = re.compile(r"Invoice Date\s*[:\s]*(\d{2}-\d{2}-\d{4})")
+
+# Every total layout starts with the word "total"; the text is scanned once for it
+# and the layout patterns below only run on a short window after each hit, in priority order.
+# The bounded window keeps the lazy .*? gaps from backtracking across the whole invoice.
+TOTAL_ANCHOR_RE = re.compile(r"total")
+TOTAL_WINDOW = 400
+TOTAL_PATTERNS = [re.compile(p) for p in [
+    r"total\s*amount\s*\(tax\s*included\)\s*([\d,]+\.\d{2})",
+    r"total\s*tax\s*included.*?([\d,]+\.\d{2})",
+    r"total\s*amount\s*\(tax\s*included\)\s*inr\s*([\d,]+\.\d{2})",
+    r"total\s*amount.*?tax\s*included.*?([\d,]+\.\d{2})",
+    r"total.*?tax\s*included.*?inr\s*([\d,]+\.\d{2})",
+    r"total\s*amount.*?([\d,]+\.\d{2})"
+]]
+# Patterns that name "tax included" explicitly are safe to accept from a single page
+TAX_INCLUDED_PATTERNS = TOTAL_PATTERNS[:5]
+
+# --- STAGE TIMING ---
+
+TIMING_STAGES = ["cache", "open", "extract", "parse", "pdfplumber", "total"]
+
+class StageTimer:
+    """
+    Wall time per parsing stage for one file, plus the fallback branches taken.
+    Stages nest; time is charged to the innermost one, so stage times add up to the file's wall time.
+    """
+
+    def __init__(self, size=None):
+        self.stages = {}
+        self.branches = []
+        self.pages = None
+        self.bytes = size
+        self._stack = []
+        self._mark = None
+
+    def _charge(self, now):
+        name = self._stack[-1]
+        self.stages[name] = self.stages.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(now)
+        self._stack.append(name)
+        self._mark = now
+        try:
+            yield
+        finally:
+            self._charge(time.perf_counter())
+            self._stack.pop()
+
+    def branch(self, name):
+        if name not in self.branches:
+            self.branches.append(name)
+
+    def record(self):
+        """Plain dict for meta/JSON: wall, stages, pages, bytes, branches."""
+        return {
+            "wall": round(sum(self.stages.values()), 6),
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "branches": list(self.branches)
+        }
+
+def timing_report(named_timings):
+    """
+    Takes [(file name, StageTimer.record() or None)] and returns (files, totals):
+    per-file rows slowest first, and batch totals per stage.
+    """
+    files = []
+    totals = {"Files": 0, "Pages": 0, "Bytes": 0, "Wall (s)": 0.0}
+    totals.update({f"{stage} (s)": 0.0 for stage in TIMING_STAGES})
+    for name, timing in named_timings:
+        if not timing:
+            continue
+        row = {
+            "File": name,
+            "Wall (s)": timing["wall"],
+            "Pages": timing["pages"],
+            "Bytes": timing["bytes"],
+            "Branches": ", ".join(timing["branches"]) or "-"
+        }
+        row.update({f"{stage} (s)": timing["stages"].get(stage, 0.0) for stage in TIMING_STAGES})
+        files.append(row)
+
+        totals["Files"] += 1
+        totals["Pages"] += timing["pages"] or 0
+        totals["Bytes"] += timing["bytes"] or 0
+        for column in ["Wall (s)"] + [f"{stage} (s)" for stage in TIMING_STAGES]:
+            totals[column] += row[column]
+
+    files.sort(key=lambda r: r["Wall (s)"], reverse=True)
+    return files, {k: round(v, 6) if isinstance(v, float) else v for k, v in totals.items()}
+
+# --- PDF PARSING ---
+
+def clean_campaign_name_final(name_list):
+    """Joins fragments and strictly removes 'Exclusive)' noise."""
+    full_name = NOISE_RE.sub("", " ".join(name_list).strip())
+    return full_name.replace("  ", " ").strip(" :,\"")
+
+def extract_page_texts(pdf_obj):
+    """Extracts the text of every page exactly once. Empty pages become ''."""
+    return [page.extract_text() or "" for page in pdf_obj.pages]
+
+def _flatten(text):
+    # Normalize text
+    return (
+        text
+        .replace("\n", " ")
+        .replace("\r", " ")
+        .replace(",", "")
+        .lower()
+    )
+
+def _match_total(flat, patterns):
+    windows = [flat[m.start():m.start() + TOTAL_WINDOW] for m in TOTAL_ANCHOR_RE.finditer(flat)]
+
+    for pattern in patterns:
+        for window in windows:
+            match = pattern.match(window)
+            if match:
+                return float(match.group(1))
+    return None
+
+def _iter_page_texts_reversed(pdf_obj):
+    # Extracts lazily from the last page so an early hit skips the rest of the document
+    for page in reversed(pdf_obj.pages):
+        yield page.extract_text() or ""
+
+def get_total_amount_from_bottom(pdf_obj=None, page_texts=None, timer=None):
+    """
+    Extracts 'Total Amount (tax included)' from ANY invoice layout.
+    Handles boxes, tables, line breaks, INR before/after value.
+    Walks pages from last to first and stops at the first page with a tax-included
+    total; only if no single page has one is the whole document searched.
+    Pass page_texts to reuse text that was already extracted; a StageTimer gets
+    the branch that found the total.
+    """
+    timer = timer or StageTimer()
+
+    if page_texts is not None:
+        reversed_texts = reversed(page_texts)
+    else:
+        reversed_texts = _iter_page_texts_reversed(pdf_obj)
+
+    seen = []
+    try:
+        for text in reversed_texts:
+            seen.append(text)
+            total = _match_total(_flatten(text), TAX_INCLUDED_PATTERNS)
+            if total is not None:
+                timer.branch("total: page" if len(seen) == 1 else f"total: page -{len(seen)}")
+                return total
+    except Exception:
+        # Fallback if pypdf fails (e.g. KeyError: 'bbox')
+        timer.branch("total: pdfplumber text")
+        seen = []
+        if hasattr(pdf_obj, 'stream'): # Likely pypdf
+            try:
+                with pdfplumber.open(pdf_obj.stream) as pl_pdf:
+                    seen = extract_page_texts(pl_pdf)[::-1]
+            except: pass
+        else: # Likely pdfplumber or similar
+            seen = extract_page_texts(pdf_obj)[::-1]
+
+    # Label and value split across pages, or only the looser "total amount" layout
+    total = _match_total(_flatten("\n".join(reversed(seen))), TOTAL_PATTERNS)
+    if total is not None:
+        timer.branch("total: whole document")
+        return total
+
+    raise ValueError("❌ 'Total Amount (tax included)' not found in invoice")
+
+def extract_invoice_meta(page_texts, final_total):
+    """Reads invoice number/date from the first page text."""
+    first_page_text = (page_texts[0] if page_texts else "").replace('\n', ' ')
+
+    inv_num = INVOICE_NUMBER_RE.search(first_page_text)
+    inv_date = INVOICE_DATE_RE.search(first_page_text)
+
+    return {
+        "num": inv_num.group(1).strip() if inv_num else "N/A",
+        "date": inv_date.group(1).strip() if inv_date else "N/A",
+        "total": float(final_total)
+    }
+
+class CampaignRowParser:
+    """
+    Line-based campaign table parser. State (inside the table, pending name
+    fragments) carries across pages so names wrapped over a page break survive.
+    `missed` counts campaign-type tokens that did not turn into a row, which is
+    how a page that pypdf mangled is detected.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.name_accum = []
+        self.is_table = False
+        self.missed = 0
+
+    def snapshot(self):
+        return list(self.rows), list(self.name_accum), self.is_table, self.missed
+
+    def restore(self, snap):
+        rows, name_accum, self.is_table, self.missed = snap
+        self.rows, self.name_accum = list(rows), list(name_accum)
+
+    def feed(self, lines):
+        for line in lines:
+            line = line.strip()
+            if "Campaign" in line and "Clicks" in line:
+                self.is_table = True
+                self.name_accum = [] 
+                continue
+            
+            type_count = len(CAMPAIGN_TYPE_RE.findall(line))
+            if not self.is_table:
+                self.missed += type_count
+                continue
+
+            metric_match = METRIC_RE.search(line)
+            
+            if metric_match:
+                self.missed += type_count - 1
+                name_part = line[:metric_match.start()].strip()
+                if name_part:
+                    self.name_accum.append(name_part)
+                
+                self.rows.append({
+                    "Campaign": clean_campaign_name_final(self.name_accum),
+                    "Campaign Type": metric_match.group(1).upper(),
+                    "Clicks": int(metric_match.group(2)),
+                    "Average CPC": float(metric_match.group(3).replace(',', '')),
+                    "Amount": float(metric_match.group(4).replace(',', ''))
+                })
+                self.name_accum = []
+            else:
+                self.missed += type_count
+                if any(k in line for k in ["FROM", "Trade Center", "Invoice Number", "Summary"]):
+                    self.name_accum = []
+                    continue
+                self.name_accum.append(line)
+
+def attach_meta(rows, meta):
+    """Adds the invoice-level columns to every campaign row."""
+    for row in rows:
+        row["Invoice Number"] = meta["num"]
+        row["Invoice date"] = meta["date"]
+        row["Total Amount (tax included)"] = meta["total"]
+    return rows
+
+def parse_campaign_rows(page_texts, meta):
+    """Line-based campaign table parser used on the pypdf text."""
+    parser = CampaignRowParser()
+    for text in page_texts:
+        if text:
+            parser.feed(text.split('\n'))
+    return attach_meta(parser.rows, meta)
+
+def _plumber_page_lines(page):
+    """
+    Rebuilds text lines from pdfplumber's word boxes (no table detection).
+    Returns (all_lines, table_lines) where table_lines start at the
+    'Campaign ... Clicks' header when the page has one.
+    """
+    words = page.extract_words(use_text_flow=True)
+    lines = []
+    current, current_top = [], None
+    for word in sorted(words, key=lambda w: (round(w["top"]), w["x0"])):
+        if current_top is not None and abs(word["top"] - current_top) > 3:
+            lines.append(" ".join(w["text"] for w in current))
+            current = []
+        if not current:
+            current_top = word["top"]
+        current.append(word)
+    if current:
+        lines.append(" ".join(w["text"] for w in current))
+
+    for i, line in enumerate(lines):
+        if "Campaign" in line and "Clicks" in line:
+            return lines, lines[i:]
+    return lines, lines
+
+def _plumber_table_rows(page):
+    """Last resort for a single page: pdfplumber's table finder with cell-based rows."""
+    table = page.extract_table()
+    if not table:
+        return []
+
+    rows = []
+    name_accum = []
+    
+    for row in table:
+        clean_row = [str(cell).strip() if cell else "" for cell in row]
+        row_str = " ".join(clean_row)
+        
+        metric_match = METRIC_RE.search(row_str)
+        
+        if metric_match:
+            possible_name = row_str[:metric_match.start()].strip()
+            if possible_name:
+                name_accum.append(possible_name)
+            
+            rows.append({
+                "Campaign": clean_campaign_name_final(name_accum),
+                "Campaign Type": metric_match.group(1).upper(),
+                "Clicks": int(metric_match.group(2)),
+                "Average CPC": float(metric_match.group(3).replace(',', '')),
+                "Amount": float(metric_match.group(4).replace(',', ''))
+            })
+            name_accum = []
+        else:
+            if any(k in row_str.upper() for k in ["CAMPAIGN", "CLICKS", "FROM", "TRADE CENTER", "INVOICE NUMBER", "SUMMARY"]):
+                name_accum = []
+                continue
+            if any(c for c in clean_row if c):
+                name_accum.append(row_str)
+    return rows
+
+def empty_meta():
+    """Invoice meta for a file that produced nothing."""
+    return {"num": "N/A", "date": "N/A", "total": None,
+            "layout": None, "layout_label": None, "parser": None, "dispatched": None, "timing": None,
+            "plumber_pages": None, "reconciliation": None, "difference": None}
+
+def layout_fingerprint(producer, width, height, first_page_text):
+    """
+    Cheap layout identity: PDF producer, first page size and the first alphabetic
+    header words (numbers are skipped so invoice-specific values don't split layouts).
+    Returns (fingerprint, human readable label).
+    """
+    tokens = [t.lower() for t in LAYOUT_TOKEN_RE.findall(first_page_text or "")[:LAYOUT_TOKENS]]
+    size = f"{round(width or 0)}x{round(height or 0)}"
+    producer = (producer or "unknown").strip()
+    key = "|".join([producer, size, " ".join(tokens)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12], f"{producer} {size} {' '.join(tokens[:4])}"
+
+def _parse_pages(page_texts, plumber_page, timer=None):
+    """
+    Runs the row parser over page_texts (None = let pdfplumber read the page).
+    Returns (rows, fallback_pages, page_texts) with rows lacking invoice meta.
+    """
+    timer = timer or StageTimer()
+    fallback_pages = 0
+    parser = CampaignRowParser()
+    for i, text in enumerate(page_texts):
+        before = parser.snapshot()
+        if text:
+            with timer.stage("parse"):
+                parser.feed(text.split('\n'))
+            if parser.missed == before[3]:
+                continue
+        after_pypdf = parser.snapshot()
+        pypdf_added = len(after_pypdf[0]) - len(before[0])
+
+        # This page needs pdfplumber: retry just this page with word-level lines
+        parser.restore(before)
+        with timer.stage("pdfplumber"):
+            all_lines, table_lines = _plumber_page_lines(plumber_page(i))
+        if not text:
+            page_texts[i] = "\n".join(all_lines)
+        with timer.stage("parse"):
+            parser.feed(table_lines)
+
+        if len(parser.rows) == len(before[0]) and parser.missed > before[3]:
+            with timer.stage("pdfplumber"):
+                table_rows = _plumber_table_rows(plumber_page(i))
+            timer.branch("table finder")
+            if table_rows:
+                parser.restore(before)
+                parser.rows.extend(table_rows)
+
+        if len(parser.rows) - len(before[0]) > pypdf_added:
+            fallback_pages += 1
+        elif text is not None:
+            # pdfplumber did no better; keep what pypdf had
+            parser.restore(after_pypdf)
+
+    return parser.rows, fallback_pages, [t or "" for t in page_texts]
+
+def parse_invoice_bytes(pdf_bytes, layout_parsers=None, timer=None, parser=None):
+    """
+    Parses raw PDF bytes. Returns (rows, method, meta).
+
+    pypdf handles every page it can. A page whose text extraction raises, comes
+    back empty, or leaves campaign rows unparsed is re-read with pdfplumber on its
+    own; the rest of the document keeps its pypdf rows. method is "pypdf" when no
+    page needed pdfplumber, "fallback_success" when some did, "failed" on no rows.
+
+    layout_parsers maps layout fingerprints to the parser that worked last time
+    ("pypdf" or "pdfplumber"); a "pdfplumber" entry skips the pypdf text pass, as does
+    parser="pdfplumber" for this file alone. meta carries the fingerprint and the parser
+    used so callers can update that map, meta["reconciliation"] whether the rows add
+    up to the invoice total (see reconcile_meta), and meta["timing"] the StageTimer
+    record for the processing report.
+    """
+    meta = empty_meta()
+    timer = timer or StageTimer()
+    timer.bytes = len(pdf_bytes)
+
+    plumber = None
+
+    def plumber_page(i):
+        nonlocal plumber
+        if plumber is None:
+            plumber = pdfplumber.open(io.BytesIO(pdf_bytes))
+        return plumber.pages[i]
+
+    try:
+        # Fingerprint from whichever library can open the file; page 0 text is reused below
+        with timer.stage("open"):
+            try:
+                reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+                page_count = len(reader.pages)
+                first_page = reader.pages[0]
+                producer = (reader.metadata or {}).get("/Producer")
+                width, height = float(first_page.mediabox.width), float(first_page.mediabox.height)
+                with timer.stage("extract"):
+                    try:
+                        first_text = first_page.extract_text() or ""
+                    except Exception:
+                        first_text = None
+            except Exception:
+                timer.branch("pypdf unreadable")
+                reader = None
+                with timer.stage("pdfplumber"):
+                    first_page = plumber_page(0)
+                    page_count = len(plumber.pages)
+                    producer = plumber.metadata.get("Producer")
+                    width, height = first_page.width, first_page.height
+                first_text = None
+            timer.pages = page_count
+
+            if first_text is None:
+                with timer.stage("pdfplumber"):
+                    first_text_for_layout = plumber_page(0).extract_text()
+            else:
+                first_text_for_layout = first_text
+            meta["layout"], meta["layout_label"] = layout_fingerprint(producer, width, height, first_text_for_layout)
+            meta["dispatched"] = (layout_parsers or {}).get(meta["layout"])
+
+        rows = []
+        if parser == "pdfplumber" or meta["dispatched"] == "pdfplumber" or reader is None:
+            # Known pypdf-hostile layout: every page goes straight to pdfplumber
+            if parser == "pdfplumber":
+                timer.branch("forced to pdfplumber")
+            elif reader is not None:
+                timer.branch("dispatched to pdfplumber")
+            rows, fallback_pages, page_texts = _parse_pages([None] * page_count, plumber_page, timer)
+            fallback_pages = page_count
+
+        if not rows and reader is not None:
+            # Single pypdf extraction pass; None marks a page pypdf could not read
+            page_texts = [first_text]
+            with timer.stage("extract"):
+                for page in reader.pages[1:]:
+                    try:
+                        page_texts.append(page.extract_text() or "")
+                    except Exception:
+                        page_texts.append(None)
+            rows, fallback_pages, page_texts = _parse_pages(page_texts, plumber_page, timer)
+            if fallback_pages:
+                timer.branch(f"pdfplumber pages: {fallback_pages}/{page_count}")
+        reader = first_page = None  # Page objects are not needed past text extraction
+
+        try:
+            with timer.stage("total"):
+                final_total = get_total_amount_from_bottom(page_texts=page_texts, timer=timer)
+        except ValueError:
+            # pypdf text may have mangled the summary box; try pdfplumber text for all pages
+            timer.branch("total: pdfplumber text")
+            with timer.stage("pdfplumber"):
+                page_texts = [plumber_page(i).extract_text() or "" for i in range(page_count)]
+            with timer.stage("total"):
+                final_total = get_total_amount_from_bottom(page_texts=page_texts, timer=timer)
+
+        meta.update(extract_invoice_meta(page_texts, final_total))
+        rows = attach_meta(rows, meta)
+    except Exception:
+        timer.branch("failed")
+        meta["timing"] = timer.record()
+        return [], "failed", meta
+    finally:
+        if plumber is not None:
+            plumber.close()
+
+    meta["timing"] = timer.record()
+    if not rows:
+        return [], "failed", meta
+
+    # Most pages needing pdfplumber means pdfplumber should go first next time
+    meta["parser"] = "pdfplumber" if fallback_pages * 2 > page_count else "pypdf"
+    meta["plumber_pages"] = fallback_pages
+    reconcile_meta(rows, meta)
+    return rows, ("fallback_success" if fallback_pages else "pypdf"), meta
+
+# --- LAYOUT DISPATCH ---
+
+# Kept beside the cache directory, not in it, so cache eviction never deletes it
+LAYOUTS_PATH = os.environ.get("INVOICE_LAYOUTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".invoice_layouts.json"))
+# Every Nth file of a pdfplumber-preferred layout tries pypdf first, so the layout can switch back
+LAYOUT_PROBE_EVERY = 20
+
+class LayoutRegistry:
+    """
+    Remembers, per layout fingerprint, which parser succeeded last time, plus
+    dispatch hit counts for the processing report. Persisted as one JSON file.
+    Safe to share between sessions and background jobs.
+
+    A file dispatched to pdfplumber never runs pypdf, so its outcome says nothing
+    about the choice; such layouts are probed with pypdf every LAYOUT_PROBE_EVERY
+    files, and only files with a known outcome count towards the hit rate.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else LAYOUTS_PATH
+        self.layouts = {}
+        self._lock = threading.Lock()
+        if self.path:
+            try:
+                with open(self.path, "r", encoding="utf-8") as fh:
+                    self.layouts = json.load(fh)
+            except (OSError, ValueError):
+                pass
+
+    def parsers(self):
+        """fingerprint -> parser map to hand to parse_invoice_bytes (picklable)."""
+        with self._lock:
+            return {fp: self._dispatch(info) for fp, info in self.layouts.items() if info.get("parser")}
+
+    @staticmethod
+    def _dispatch(info):
+        if info["parser"] == "pdfplumber" and info.get("unchecked", 0) >= LAYOUT_PROBE_EVERY - 1:
+            return "pypdf"  # Probe
+        return info["parser"]
+
+    def record(self, meta):
+        fingerprint = meta.get("layout")
+        if not fingerprint:
+            return
+        with self._lock:
+            info = self.layouts.setdefault(fingerprint, {
+                "label": meta.get("layout_label"), "parser": None,
+                "files": 0, "dispatched": 0, "checked": 0, "hits": 0, "unchecked": 0
+            })
+            info["files"] += 1
+            dispatched = meta.get("dispatched")
+            if dispatched:
+                info["dispatched"] += 1
+                if dispatched == "pdfplumber":
+                    info["unchecked"] = info.get("unchecked", 0) + 1
+                else:
+                    # pypdf ran first, so meta["parser"] is the real outcome; for a
+                    # probe of a pdfplumber layout, the hit is pdfplumber still winning
+                    probe = info["parser"] == "pdfplumber"
+                    info["checked"] = info.get("checked", 0) + 1
+                    info["hits"] += meta.get("parser") == ("pdfplumber" if probe else dispatched)
+                    if probe:
+                        info["unchecked"] = 0
+            if meta.get("parser"):
+                info["parser"] = meta["parser"]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    json.dump(self.layouts, fh)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+
+    def report(self):
+        """Rows for the per-fingerprint hit-rate table."""
+        with self._lock:
+            layouts = {fp: dict(info) for fp, info in self.layouts.items()}
+        return [
+            {
+                "Layout": fp,
+                "Description": info["label"],
+                "Preferred Parser": info["parser"] or "-",
+                "Files": info["files"],
+                "Dispatched": info["dispatched"],
+                "Hit Rate": f"{info['hits'] / info['checked']:.0%}" if info.get("checked") else "-",
+            }
+            for fp, info in sorted(layouts.items(), key=lambda kv: -kv[1]["files"])
+        ]
+
+# --- RESULT CACHE ---
+
+# Bump whenever parsing logic changes so stale cached rows are not served
+PARSER_VERSION = "6"
+CACHE_DIR = os.environ.get("INVOICE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".invoice_cache"))
+CACHE_MAX_ENTRIES = 512
+CACHE_MAX_DISK_BYTES = 256 * 1024 * 1024
+CACHE_EVICT_TO = 0.9   # Eviction frees space down to this share of max_disk_bytes, so it runs rarely
+# make_key() + ".json", for any parser version
+CACHE_FILE_RE = re.compile(r"^[0-9a-f]{64}-v[^.]+\.json$")
+
+class InvoiceCache:
+    """
+    Two-tier cache of parse results keyed by SHA-256 of the PDF bytes + PARSER_VERSION.
+    Memory tier is an LRU, disk tier is one JSON file per invoice evicted oldest-first
+    once the directory grows past max_disk_bytes. The directory size is tracked as
+    entries are written, so it is only listed on the first write and when evicting.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_disk_bytes=CACHE_MAX_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()  # Shared by concurrent sessions and background jobs
+        self.hits = 0
+        self.misses = 0
+        self._disk_bytes = None   # Size of the cache files, once listed
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf_bytes):
+        return hashlib.sha256(pdf_bytes).hexdigest() + "-v" + PARSER_VERSION
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            self._put(key, entry)
+
+    def _get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        if self.cache_dir:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as fh:
+                    entry = json.load(fh)
+                os.utime(self._path(key))  # Refresh recency for disk eviction
+                self._remember(key, entry)
+                self.hits += 1
+                return entry
+            except (OSError, ValueError):
+                pass
+
+        self.misses += 1
+        return None
+
+    def _put(self, key, entry):
+        self._remember(key, entry)
+        if not self.cache_dir:
+            return
+        try:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(entry, fh)
+            try:
+                self._disk_bytes -= os.path.getsize(self._path(key))  # Overwritten
+            except OSError:
+                pass
+            self._disk_bytes += os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key))
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+        except OSError:
+            pass
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_files(self):
+        # [(mtime, size, path)] of the cache entries on disk, never other files kept here
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not CACHE_FILE_RE.match(name):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st_ = os.stat(path)
+            except OSError:
+                continue
+            files.append((st_.st_mtime, st_.st_size, path))
+        return files
+
+    def _evict_disk(self):
+        # Lists the directory again, which also picks up entries other processes wrote
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes * CACHE_EVICT_TO:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+def process_invoice(pdf_file, cache=None, layouts=None, timer=None):
+    # Use bytes for both to avoid re-reading
+    pdf_bytes = pdf_file.read()
+    pdf_file.seek(0)
+    timer = timer or StageTimer()
+
+    key = None
+    if cache is not None:
+        with timer.stage("cache"):
+            key = cache.make_key(pdf_bytes)
+            entry = cache.get(key)
+        if entry is not None:
+            timer.branch("cache hit")
+            timer.bytes = len(pdf_bytes)
+            timer.pages = (entry["meta"].get("timing") or {}).get("pages")
+            return entry["rows"], entry["method"]
+
+    layout_parsers = layouts.parsers() if layouts is not None else None
+    rows, method, meta = parse_invoice_bytes(pdf_bytes, layout_parsers, timer)
+    if _needs_reparse(meta):
+        second = parse_invoice_bytes(pdf_bytes, layout_parsers, parser="pdfplumber")
+        rows, method, meta = _pick_reparse((rows, method, meta), second)
+    if cache is not None:
+        cache.put(key, {"rows": rows, "method": method, "meta": meta})
+    if layouts is not None:
+        layouts.record(meta)
+
+    return rows, method
+
+# --- STREAMED INPUT ---
+
+PDF_MAGIC = b"%PDF-"
+PREFETCH_DEPTH = 4                        # Files read ahead of the parser
+ZIP_MEMBER_MAX_BYTES = 256 * 1024 * 1024  # Larger members are skipped, not inflated
+
+def _is_pdf_name(name):
+    base = os.path.basename(name)
+    # macOS archives carry "._name.pdf" resource forks next to the real files
+    return base.lower().endswith(".pdf") and not base.startswith("._") and not name.startswith("__MACOSX/")
+
+def _accept(name, data, seen, skipped):
+    """Content hash of a file worth parsing, or None after noting why it is skipped."""
+    if PDF_MAGIC not in data[:1024]:
+        skipped.append((name, "not a PDF"))
+        return None
+    content_hash = hashlib.sha256(data).hexdigest()
+    if content_hash in seen:
+        skipped.append((name, "duplicate"))
+        return None
+    seen.add(content_hash)
+    return content_hash
+
+def zip_pdf_members(source):
+    """ZipInfo of the PDF members of an archive, from its central directory (nothing is inflated)."""
+    with zipfile.ZipFile(source) as archive:
+        return [info for info in archive.infolist() if not info.is_dir() and _is_pdf_name(info.filename)]
+
+def iter_zip_pdfs(source, seen=None, skipped=None):
+    """
+    Yields (member_name, content_hash, pdf_bytes) for the PDFs in a ZIP archive
+    (a path or a seekable file object), inflating one member at a time.
+    Non-PDF, oversized, unreadable and duplicate members (by content hash, across
+    everything sharing `seen`) are skipped and noted in `skipped` as (name, reason).
+    """
+    seen = set() if seen is None else seen
+    skipped = [] if skipped is None else skipped
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if not _is_pdf_name(info.filename):
+                skipped.append((info.filename, "not a PDF"))
+                continue
+            if info.file_size > ZIP_MEMBER_MAX_BYTES:
+                skipped.append((info.filename, "too large"))
+                continue
+            try:
+                data = archive.read(info)
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError, OSError):
+                # Corrupt, encrypted or unsupported compression
+                skipped.append((info.filename, "unreadable"))
+                continue
+            content_hash = _accept(info.filename, data, seen, skipped)
+            if content_hash is not None:
+                yield info.filename, content_hash, data
+
+def iter_path_pdfs(paths, seen=None, skipped=None):
+    """
+    Yields (path, content_hash, pdf_bytes) for PDF files and the PDF members of ZIP
+    archives ("archive.zip/member.pdf"), reading one file at a time and skipping
+    non-PDF and duplicate content like iter_zip_pdfs.
+    """
+    seen = set() if seen is None else seen
+    skipped = [] if skipped is None else skipped
+    for path in paths:
+        if path.lower().endswith(".zip"):
+            members_skipped = []
+            try:
+                for name, content_hash, data in iter_zip_pdfs(path, seen, members_skipped):
+                    yield os.path.join(path, name), content_hash, data
+            except zipfile.BadZipFile:
+                skipped.append((path, "unreadable"))
+            finally:
+                skipped.extend((os.path.join(path, name), reason) for name, reason in members_skipped)
+            continue
+        with open(path, "rb") as fh:
+            data = fh.read()
+        content_hash = _accept(path, data, seen, skipped)
+        if content_hash is not None:
+            yield path, content_hash, data
+
+def prefetch(items, depth=PREFETCH_DEPTH):
+    """
+    Iterates `items` on a background thread, keeping up to `depth` of them ready, so
+    reading or inflating the next file overlaps with parsing the current ones while
+    at most `depth` extra files are held in memory. Errors re-raise in the consumer.
+    """
+    ready = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fill():
+        source = iter(items)
+        try:
+            for item in source:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except Exception as e:
+            put((end, e))
+        finally:
+            # Closes e.g. the archive when the consumer stopped early
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = ready.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+# --- RECONCILIATION ---
+
+GST_FACTOR = 1.18
+RECONCILE_ABS_TOLERANCE = 1.0     # INR; absorbs per-line rounding of the 18% GST
+RECONCILE_REL_TOLERANCE = 0.001   # Of the invoice total
+
+def reconcile_difference(amount_sum, total):
+    """Extracted total minus summed Amount x 1.18. Works on scalars and on aligned Series."""
+    return total - amount_sum * GST_FACTOR
+
+def reconciled(difference, total):
+    """True where the difference is within tolerance. Works on scalars and on aligned Series."""
+    return abs(difference) <= RECONCILE_ABS_TOLERANCE + RECONCILE_REL_TOLERANCE * abs(total)
+
+def reconcile_meta(rows, meta):
+    """Sets meta["difference"] and meta["reconciliation"] ("ok" or "mismatch") for one parsed file."""
+    difference = reconcile_difference(sum(row["Amount"] for row in rows), meta["total"])
+    meta["difference"] = round(difference, 2) + 0.0  # + 0.0 turns -0.0 into 0.0
+    meta["reconciliation"] = "ok" if reconciled(difference, meta["total"]) else "mismatch"
+
+def _needs_reparse(meta):
+    """A file whose rows do not add up and that still has pages pdfplumber did not read."""
+    pages = (meta.get("timing") or {}).get("pages")
+    return meta.get("reconciliation") == "mismatch" and (meta.get("plumber_pages") or 0) < (pages or 0)
+
+def _merge_timing(first, second, elapsed=None):
+    # Both passes count towards the file's time; branches read first pass, then re-parse
+    second = second or {"wall": round(elapsed or 0.0, 6), "stages": {}, "branches": []}
+    merged = dict(second)
+    merged["wall"] = round(first["wall"] + second["wall"], 6)
+    merged["stages"] = {
+        stage: round(first["stages"].get(stage, 0.0) + second["stages"].get(stage, 0.0), 6)
+        for stage in dict.fromkeys([*first["stages"], *second["stages"]])
+    }
+    merged["branches"] = first["branches"] + ["reconcile re-parse"] + second["branches"]
+    merged["pages"], merged["bytes"] = first["pages"], first["bytes"]
+    return merged
+
+def _pick_reparse(first, second, elapsed=None):
+    """
+    Chooses between a file's first pass (rows, method, meta) and its all-pdfplumber
+    re-parse: the re-parse wins, as method "reparsed", only if it reconciles.
+    second's meta is None when the re-parse timed out or crashed.
+    """
+    rows, method, meta = second
+    timing = _merge_timing(first[2]["timing"], meta["timing"] if meta is not None else None, elapsed)
+    if meta is not None and rows and meta["reconciliation"] == "ok":
+        # One file needing a re-parse should not move its whole layout to pdfplumber
+        method = "reparsed"
+        meta["parser"], meta["dispatched"] = first[2]["parser"], first[2]["dispatched"]
+    else:
+        rows, method, meta = first
+        meta = dict(meta)
+    meta["timing"] = timing
+    return rows, method, meta
+
+RECONCILE_COLUMNS = ["File", "Invoice Number", "Rows", "Amount", "Total"]
+
+def reconcile(totals):
+    """
+    Reconciliation table from one row per source file (RECONCILE_COLUMNS, Amount summed):
+    adds Expected (Amount x 1.18), Difference and Status. Rows are per file, not per
+    Invoice Number, which repeats for identical uploads and is "N/A" when not found.
+    """
+    totals = pd.DataFrame(totals, columns=RECONCILE_COLUMNS)
+    totals["Expected"] = totals["Amount"] * GST_FACTOR
+    difference = reconcile_difference(totals["Amount"], totals["Total"])
+    totals["Difference"] = difference.round(2) + 0.0  # + 0.0 turns -0.0 into 0.0
+    totals["Status"] = reconciled(difference, totals["Total"]).map({True: "ok", False: "mismatch"})
+    return totals.round({"Amount": 2, "Total": 2, "Expected": 2})
+
+# --- PARALLEL BATCH PROCESSING ---
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_FILE_TIMEOUT = 120  # seconds a single PDF may take before its worker is killed
+# Opt-in: keep a warmed worker pool alive between batches (see WorkerPool)
+WARM_WORKERS = os.environ.get("INVOICE_WARM_WORKERS", "") not in ("", "0")
+# Yielded by a long-lived item feed that has nothing to parse right now (see ExtractionService)
+IDLE = object()
+
+def _warm_worker():
+    # Pool initializer: imports the PDF stack and runs a blank page through both parsers,
+    # so a worker's first invoice does not pay for imports and first-use setup
+    try:
+        writer = pypdf.PdfWriter()
+        writer.add_blank_page(width=595, height=842)
+        blank = io.BytesIO()
+        writer.write(blank)
+        parse_invoice_bytes(blank.getvalue())
+    except Exception:
+        pass  # A cold worker still works
+
+# Workers start from a clean interpreter, never forked from a threaded server whose
+# other threads may hold locks (e.g. a half-done LazyModule import) the child would inherit
+POOL_CONTEXT = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+def _start_worker(started):
+    # Pool initializer: reports the worker's pid so its pool can kill it, then warms up
+    started.put(os.getpid())
+    _warm_worker()
+
+class _WorkerProcessPool(ProcessPoolExecutor):
+    """
+    A ProcessPoolExecutor of warmed workers that knows their pids (each reports in as
+    it starts), so kill() can stop a worker stuck on a hung PDF; shutdown() alone
+    would wait for it.
+    """
+
+    def __init__(self, max_workers):
+        self.pids = set()
+        self.started = POOL_CONTEXT.SimpleQueue()
+        super().__init__(max_workers=max_workers, mp_context=POOL_CONTEXT, initializer=_start_worker, initargs=(self.started,))
+
+    def kill(self):
+        while not self.started.empty():
+            self.pids.add(self.started.get())
+        for pid in self.pids:
+            try:
+                os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))  # SIGTERM terminates on Windows
+            except OSError:
+                pass  # Already gone
+        self.shutdown(wait=False, cancel_futures=True)
+
+def _new_pool(max_workers):
+    return _WorkerProcessPool(max_workers)
+
+class WorkerPool:
+    """
+    Keeps one warmed process pool alive between batches. warm() starts it ahead of the
+    first batch (e.g. when the app starts); iter_invoice_batch(worker_pool=...) borrows
+    it and hands it back when the batch ends with nothing running, so later batches
+    skip process start-up and imports. A pool killed over a timeout or crash is replaced.
+    """
+
+    def __init__(self):
+        self._idle = None   # (max_workers, ProcessPoolExecutor)
+        self._lock = threading.Lock()
+
+    def warm(self, max_workers=DEFAULT_WORKERS):
+        """Starts a pool of max_workers and waits until every worker has warmed up."""
+        pool = self.acquire(max_workers)
+        try:
+            # One task per worker so pools that spawn workers on demand start them all
+            wait([pool.submit(int) for _ in range(max_workers)])
+        finally:
+            self.release(max_workers, pool)
+
+    def acquire(self, max_workers):
+        with self._lock:
+            idle, self._idle = self._idle, None
+        if idle is not None:
+            if idle[0] == max_workers:
+                return idle[1]
+            idle[1].shutdown(wait=False, cancel_futures=True)
+        return _new_pool(max_workers)
+
+    def release(self, max_workers, pool):
+        with self._lock:
+            if self._idle is None:
+                self._idle = (max_workers, pool)
+                return
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_invoice_batch(items, cache=None, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_FILE_TIMEOUT, layouts=None, reparse=True,
+                       worker_pool=None):
+    """
+    Parses (name, pdf_bytes) items and yields (index, rows, method, meta) in completion order.
+    `items` may be a lazy iterable; it is only advanced when a worker slot is free, so at
+    most a handful of PDFs are held in memory. A PDF that hangs past `timeout` is reported
+    as "timeout"; one that kills its worker is reported as "failed".
+    An item may be IDLE (the feed has nothing yet but is not finished); the batch keeps
+    collecting running files and asks again, so the feed should block briefly first.
+    With a LayoutRegistry, each file is dispatched to the parser its layout preferred last time.
+    With reparse, a file whose rows do not reconcile with its total is parsed again with
+    pdfplumber on every page, and the re-parse is kept if it reconciles.
+    With a WorkerPool, its warm processes are used instead of starting new ones.
+    """
+    items = enumerate(items)
+    pending = {}        # index -> (pdf_bytes, cache key) for files not finished yet
+    first_pass = {}     # index -> (rows, method, meta) of a file being re-parsed
+    suspects = deque()  # Files in flight when a worker died, retried one at a time
+    inflight = deque()  # Files pushed back after a pool rebuild
+    running = {}        # future -> (index, start time, isolated)
+    exhausted = False
+    layout_parsers = layouts.parsers() if layouts is not None else None
+
+    def next_todo():
+        # Returns the next index that needs parsing, serving cache hits along the way
+        nonlocal exhausted
+        while not exhausted:
+            try:
+                i, item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            if item is IDLE:
+                return None
+            _, pdf_bytes = item
+            key = None
+            if cache is not None:
+                timer = StageTimer(len(pdf_bytes))
+                with timer.stage("cache"):
+                    key = cache.make_key(pdf_bytes)
+                    entry = cache.get(key)
+                if entry is not None:
+                    # Timing reflects this lookup; the original parse timing is not replayed
+                    timer.branch("cache hit")
+                    timer.pages = (entry["meta"].get("timing") or {}).get("pages")
+                    ready.append((i, entry["rows"], entry["method"], dict(entry["meta"], timing=timer.record())))
+                    continue
+            pending[i] = (pdf_bytes, key)
+            return i
+        return None
+
+    def finish(i, rows, method, meta=None, elapsed=None):
+        nonlocal layout_parsers
+        if i in first_pass:
+            rows, method, meta = _pick_reparse(first_pass.pop(i), (rows, method, meta), elapsed)
+        elif reparse and meta is not None and _needs_reparse(meta):
+            # Rows do not add up to the total: queue the file again for pdfplumber
+            first_pass[i] = (rows, method, meta)
+            inflight.append(i)
+            return
+        pdf_bytes, key = pending.pop(i)
+        if meta is None:
+            meta = empty_meta()
+            meta["timing"] = {"wall": round(elapsed or 0.0, 6), "stages": {}, "pages": None,
+                              "bytes": len(pdf_bytes), "branches": [method]}
+        elif cache is not None:
+            cache.put(key, {"rows": rows, "method": method, "meta": meta})
+        if layouts is not None:
+            layouts.record(meta)
+            layout_parsers = layouts.parsers()
+        ready.append((i, rows, method, meta))
+
+    def parser_for(i):
+        return "pdfplumber" if i in first_pass else None
+
+    ready = []
+
+    if max_workers <= 1:
+        try:
+            while True:
+                i = inflight.popleft() if inflight else next_todo()
+                yield from ready
+                ready.clear()
+                if i is None:
+                    if exhausted:
+                        return
+                    continue
+                rows, method, meta = parse_invoice_bytes(pending[i][0], layout_parsers, parser=parser_for(i))
+                finish(i, rows, method, meta)
+        finally:
+            if layouts is not None:
+                layouts.save()
+
+    pool = worker_pool.acquire(max_workers) if worker_pool is not None else _new_pool(max_workers)
+    try:
+        while True:
+            # Only submit what can start right away so submit time ~ start time
+            source, window = (suspects, 1) if suspects else (inflight, max_workers)
+            broken = False
+            while len(running) < window:
+                if source:
+                    i = source.popleft()
+                elif source is inflight:
+                    i = next_todo()
+                    if i is None:
+                        break
+                else:
+                    break
+                try:
+                    future = pool.submit(parse_invoice_bytes, pending[i][0], layout_parsers, parser=parser_for(i))
+                except BrokenProcessPool:
+                    # A worker died since the last wait; its futures are collected below
+                    source.appendleft(i)
+                    broken = True
+                    break
+                running[future] = (i, time.monotonic(), source is suspects)
+
+            yield from ready
+            ready.clear()
+            if not running and not suspects and not inflight and exhausted:
+                return
+
+            done, _ = wait(running, timeout=0.25, return_when=FIRST_COMPLETED)
+
+            crashed = []
+            for future in done:
+                i, started, isolated = running.pop(future)
+                try:
+                    rows, method, meta = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if isolated:
+                        finish(i, [], "failed", elapsed=time.monotonic() - started)
+                    else:
+                        crashed.append(i)
+                    continue
+                except Exception:
+                    finish(i, [], "failed", elapsed=time.monotonic() - started)
+                    continue
+                finish(i, rows, method, meta)
+
+            now = time.monotonic()
+            expired = [f for f, (_, started, _) in running.items() if now - started > timeout]
+
+            if broken or expired:
+                for future in expired:
+                    i, started, _ = running.pop(future)
+                    finish(i, [], "timeout", elapsed=now - started)
+                # Whatever else was running is innocent of a timeout but suspect in a crash
+                innocent = [i for i, _, _ in running.values()]
+                running.clear()
+                if crashed:
+                    suspects.extend(sorted(crashed + innocent))
+                else:
+                    inflight.extendleft(reversed(innocent))
+                pool.kill()
+                pool = _new_pool(max_workers)
+
+            yield from ready
+            ready.clear()
+    finally:
+        if worker_pool is not None and not running:
+            worker_pool.release(max_workers, pool)
+        else:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if layouts is not None:
+            layouts.save()
+
+def iter_invoice_batch_ordered(items, **kwargs):
+    """Same as iter_invoice_batch, but yields in input order (buffers early finishers)."""
+    buffered = {}
+    next_index = 0
+    for i, rows, method, meta in iter_invoice_batch(items, **kwargs):
+        buffered[i] = (rows, method, meta)
+        while next_index in buffered:
+            rows, method, meta = buffered.pop(next_index)
+            yield next_index, rows, method, meta
+            next_index += 1
+
+def _close_files(files):
+    # Stops e.g. a prefetch() thread that would otherwise keep inflated PDFs alive
+    close = getattr(files, "close", None)
+    if close is not None:
+        close()
+
+class ExtractionJob:
+    """
+    Runs iter_invoice_batch on a background thread so the caller (e.g. a Streamlit
+    script) is not blocked. `files` is an iterable of (key, name, content_hash, pdf_bytes);
+    pdf_bytes may be any bytes-like object and is only copied when the file is handed
+    to a worker. It may be a lazy stream (e.g. iter_zip_pdfs), in which case pass the
+    expected `total` and the container it notes `skipped` files in, kept for display.
+    Files are recorded in `files` as {key: (name, content_hash)} as they are read.
+    Finished files accumulate in `results` as {key: (rows, method, meta)}.
+
+    cancel() stops new files from starting and drops the job once the running ones
+    end. Finished files are already in the cache passed in, so a new job over the
+    same files resumes instead of starting over.
+    """
+
+    def __init__(self, files, total=None, skipped=None, **batch_kwargs):
+        self.total = total if total is not None else len(files)
+        self.skipped = skipped
+        self.keys = []        # In the order files were read
+        self.files = {}
+        self.results = {}
+        self.state = "running"   # running / done / cancelled / failed
+        self.error = None
+        self.started = time.time()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._start(files, batch_kwargs)
+
+    def _start(self, files, batch_kwargs):
+        self._thread = threading.Thread(target=self._run, args=(files, batch_kwargs), daemon=True)
+        self._thread.start()
+
+    def _read(self, key, name, content_hash):
+        with self._lock:
+            self.keys.append(key)
+            self.files[key] = (name, content_hash)
+
+    def _finish(self, key, rows, method, meta):
+        with self._lock:
+            self.results[key] = (rows, method, meta)
+
+    def _items(self, files):
+        try:
+            for key, name, content_hash, data in files:
+                if self._cancel.is_set():
+                    return
+                self._read(key, name, content_hash)
+                yield name, bytes(data)
+        finally:
+            _close_files(files)
+
+    def _run(self, files, batch_kwargs):
+        items = self._items(files)
+        batch = iter_invoice_batch(items, **batch_kwargs)
+        try:
+            for i, rows, method, meta in batch:
+                self._finish(self.keys[i], rows, method, meta)
+                if self._cancel.is_set():
+                    break
+            state = "cancelled" if self._cancel.is_set() else "done"
+        except Exception as e:
+            state, self.error = "failed", str(e)
+        finally:
+            batch.close()
+            items.close()
+        self.state = state
+
+    @property
+    def completed(self):
+        return len(self.results)
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def cancel(self):
+        self._cancel.set()
+
+    def take(self, keys=None):
+        """{key: (name, content_hash, rows, method, meta)} for the given (default: all) keys that have finished."""
+        with self._lock:
+            keys = self.keys if keys is None else keys
+            return {k: self.files[k] + self.results[k] for k in keys if k in self.results}
+
+class ServiceJob(ExtractionJob):
+    """An ExtractionJob whose files are parsed by an ExtractionService rather than its own thread."""
+
+    def __init__(self, service, session, files, total=None, skipped=None):
+        self.service = service
+        self.session = session
+        self.outstanding = 0   # Files read but not finished yet
+        self._exhausted = False
+        super().__init__(files, total, skipped)
+
+    def _start(self, files, batch_kwargs):
+        self._files = iter(files)
+
+    def _read(self, key, name, content_hash):
+        super()._read(key, name, content_hash)
+        with self._lock:
+            self.outstanding += 1
+
+    def _finish(self, key, rows, method, meta):
+        with self._lock:
+            self.results[key] = (rows, method, meta)
+            self.outstanding -= 1
+        self._settle()
+
+    def _next(self):
+        # Next (key, name, content_hash, data), or None once the files run out or fail
+        try:
+            return next(self._files)
+        except StopIteration:
+            pass
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+        self._exhausted = True
+        _close_files(self._files)
+        self._settle()
+        return None
+
+    def _settle(self):
+        with self._lock:
+            if self.state == "running" and self._exhausted and not self.outstanding:
+                self.state = "done"
+
+    def cancel(self):
+        # Files already parsing finish (other jobs may share them) and still reach the cache
+        super().cancel()
+        if self.state == "running":
+            self.state = "cancelled"
+        self.service._drop(self)
+
+SERVICE_MAX_QUEUED = 5000   # Files waiting across all sessions before new uploads are held back
+SERVICE_IDLE_WAIT = 0.05    # Seconds the feed waits for new work before reporting IDLE
+
+class ExtractionService:
+    """
+    One long-lived extraction queue shared by every session in the process, so the
+    number of parser processes stays at max_workers however many users are uploading.
+    submit() returns a ServiceJob, used like an ExtractionJob. Sessions take turns
+    (one file each, round-robin) so a large upload cannot starve a small one, and a
+    file already queued or parsing for someone else is shared rather than parsed
+    twice (matched by content hash). accepts() is the backpressure check: new work
+    is held back while more than max_queued files are waiting.
+    """
+
+    def __init__(self, cache=None, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_FILE_TIMEOUT, layouts=None, reparse=True,
+                 warm=False, max_queued=SERVICE_MAX_QUEUED):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.finished = 0   # Files delivered, cache hits included
+        self.shared = 0     # Files that joined a parse already queued or running
+        self.submitted = 0  # Jobs submitted, so callers can check one upload is one job
+        self._layouts = layouts
+        self._batch_kwargs = dict(cache=cache, max_workers=max_workers, timeout=timeout, layouts=layouts, reparse=reparse)
+        self._sessions = OrderedDict()   # session -> deque of ServiceJobs with files left to read
+        self._inflight = {}              # content hash -> [(job, key), ...] waiting on one parse
+        self._hashes = {}                # batch index -> content hash
+        self._dirty = False              # Layouts recorded since they were last saved
+        self._closing = []               # Cancelled jobs whose files are still open
+        self._lock = threading.Lock()
+        self._work = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(warm,), daemon=True)
+        self._thread.start()
+
+    def submit(self, session, files, total=None, skipped=None):
+        """Queues (key, name, content_hash, pdf_bytes) files for `session`; see ExtractionJob for the arguments."""
+        job = ServiceJob(self, session, files, total, skipped)
+        with self._lock:
+            self.submitted += 1
+            self._sessions.setdefault(session, deque()).append(job)
+        self._work.set()
+        return job
+
+    def accepts(self, count):
+        """True if `count` more files may be queued now (always, when nothing is waiting)."""
+        queued = self.metrics()["queued"]
+        return not queued or queued + count <= self.max_queued
+
+    def metrics(self):
+        """Queue depth: {"queued", "in_flight", "sessions", "workers", "finished", "shared", "submitted"}."""
+        with self._lock:
+            jobs = [job for jobs in self._sessions.values() for job in jobs]
+            return {
+                "queued": sum(max(job.total - len(job.keys), 0) for job in jobs),
+                "in_flight": len(self._inflight),
+                "sessions": len(self._sessions),
+                "workers": self.max_workers,
+                "finished": self.finished,
+                "shared": self.shared,
+                "submitted": self.submitted,
+            }
+
+    def close(self):
+        self._stopped = True
+        self._work.set()
+        self._thread.join()
+
+    def _drop(self, job):
+        with self._lock:
+            jobs = self._sessions.get(job.session)
+            if jobs is not None and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self._sessions[job.session]
+            self._closing.append(job)
+        self._work.set()
+
+    def _next_file(self):
+        # Next (content_hash, name, pdf_bytes) to parse, taking sessions in turn. Only the
+        # service thread reads job files, and never under the lock: reading may wait on an
+        # archive member being inflated, and every page render needs the lock for metrics()
+        with self._lock:
+            closing, self._closing = self._closing, []
+        for job in closing:
+            _close_files(job._files)
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    return None
+                session, jobs = next(iter(self._sessions.items()))
+                self._sessions.move_to_end(session)
+                job = jobs[0]
+            entry = job._next() if not job._cancel.is_set() else None
+            with self._lock:
+                if entry is None:
+                    # The job may have been dropped (cancelled) meanwhile
+                    if jobs and jobs[0] is job:
+                        jobs.popleft()
+                    if not jobs and self._sessions.get(session) is jobs:
+                        del self._sessions[session]
+                    continue
+                key, name, content_hash, data = entry
+                job._read(key, name, content_hash)
+                waiters = self._inflight.get(content_hash)
+                if waiters is not None:
+                    waiters.append((job, key))
+                    self.shared += 1
+                    continue
+                self._inflight[content_hash] = [(job, key)]
+            return content_hash, name, bytes(data)
+
+    def _feed(self):
+        # Endless item stream for one iter_invoice_batch; its indices count IDLE items too
+        index = 0
+        while not self._stopped:
+            item = self._next_file()
+            if item is None:
+                if self._dirty and self._layouts is not None:
+                    self._dirty = False
+                    self._layouts.save()
+                self._work.wait(SERVICE_IDLE_WAIT)
+                self._work.clear()
+                yield IDLE
+            else:
+                content_hash, name, pdf_bytes = item
+                self._hashes[index] = content_hash
+                yield name, pdf_bytes
+            index += 1
+
+    def _run(self, warm):
+        worker_pool = WorkerPool() if warm else None
+        if worker_pool is not None:
+            worker_pool.warm(self.max_workers)
+        while not self._stopped:
+            batch = iter_invoice_batch(self._feed(), worker_pool=worker_pool, **self._batch_kwargs)
+            try:
+                for i, rows, method, meta in batch:
+                    with self._lock:
+                        waiters = self._inflight.pop(self._hashes.pop(i), [])
+                        self.finished += 1
+                        self._dirty = True
+                    for job, key in waiters:
+                        job._finish(key, rows, method, meta)
+            except Exception as e:
+                # Fail whoever waited on this batch; queued files start over in a new one
+                with self._lock:
+                    waiters = [w for ws in self._inflight.values() for w in ws]
+                    self._inflight.clear()
+                    self._hashes.clear()
+                for job, _ in waiters:
+                    job.state, job.error = "failed", str(e)
+            finally:
+                batch.close()
+
+# --- REPORT BUILDING ---
+
+REPORT_COLUMNS = [
+    "Campaign", "Campaign Type", "Clicks", "Average CPC", "Amount",
+    "Invoice Number", "Invoice date", "Total Amount (tax included)",
+    "With GST Amount (18%)", "Brand", "Name", "Match Tier"
+]
+ROW_COLUMNS = REPORT_COLUMNS[:8]      # Keys of a parsed campaign row
+MAPPING_COLUMNS = ["Brand", "Name", "Match Tier"]
+
+# Compact frames: repeated labels as categoricals, the invoice date parsed
+CATEGORY_COLUMNS = ["Campaign Type", "Invoice Number", "Brand", "Name", "Match Tier"]
+
+PORTFOLIO_HEADER_SCAN_ROWS = 20  # Title/banner rows allowed above the real header
+
+def _clean_column_name(col):
+    # Clean column names
+    return str(col).strip().replace("\n", " ").replace("\r", " ")
+
+def _detect_portfolio_columns(columns):
+    """Returns (portfolio_col, brand_col, name_col) as the original header values."""
+    portfolio_col = None
+    brand_col = None
+    name_col = None
+
+    for col in columns:
+        col_lower = _clean_column_name(col).lower()
+        if "portfolio" in col_lower:
+            portfolio_col = col
+        elif "brand" in col_lower:
+            brand_col = col
+        elif col_lower == "name" or col_lower.endswith(" name"):
+            name_col = col
+
+    return portfolio_col, brand_col, name_col
+
+def _portfolio_format(portfolio_file, file_name=None):
+    name = file_name or getattr(portfolio_file, "name", None) or str(portfolio_file)
+    ext = os.path.splitext(str(name).lower())[1]
+    if ext == ".csv":
+        return "csv"
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    return "excel"
+
+def _rewind(portfolio_file):
+    if hasattr(portfolio_file, "seek"):
+        portfolio_file.seek(0)
+
+def _preview_rows(portfolio_file, fmt):
+    """First few raw rows, before any header is assumed."""
+    if fmt == "csv":
+        if hasattr(portfolio_file, "read"):
+            data = portfolio_file.read()
+            fh = io.StringIO(data.decode("utf-8-sig", errors="replace") if isinstance(data, bytes) else data)
+        else:
+            fh = open(portfolio_file, "r", encoding="utf-8-sig", errors="replace", newline="")
+        with fh:
+            return [row for _, row in zip(range(PORTFOLIO_HEADER_SCAN_ROWS), csv.reader(fh))]
+
+    preview = pd.read_excel(portfolio_file, header=None, nrows=PORTFOLIO_HEADER_SCAN_ROWS)
+    return [[v for v in row if pd.notna(v)] for row in preview.itertuples(index=False, name=None)]
+
+def load_portfolio_mapping(portfolio_file, file_name=None):
+    """
+    Reads a Portfolio Report (Excel, CSV or Parquet) and returns a Campaign/Brand
+    (and Name) frame, or None if the Portfolio/Brand columns cannot be detected.
+    The header row is located from a short preview first, then only the needed
+    columns are read.
+    """
+    fmt = _portfolio_format(portfolio_file, file_name)
+    header_row = None
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        portfolio_col, brand_col, name_col = _detect_portfolio_columns(pq.ParquetFile(portfolio_file).schema_arrow.names)
+    else:
+        for r, row in enumerate(_preview_rows(portfolio_file, fmt)):
+            portfolio_col, brand_col, name_col = _detect_portfolio_columns(row)
+            if portfolio_col and brand_col:
+                header_row = r
+                break
+
+    if not (portfolio_col and brand_col):
+        return None
+
+    # Rename dynamically
+    rename_dict = {
+        portfolio_col: "Campaign",
+        brand_col: "Brand"
+    }
+
+    if name_col:
+        rename_dict[name_col] = "Name"
+
+    usecols = list(rename_dict)
+    _rewind(portfolio_file)
+    if fmt == "parquet":
+        portfolio_df = pd.read_parquet(portfolio_file, columns=usecols)
+    elif fmt == "csv":
+        portfolio_df = pd.read_csv(portfolio_file, skiprows=header_row, usecols=usecols, encoding="utf-8-sig")
+    else:
+        portfolio_df = pd.read_excel(portfolio_file, header=header_row, usecols=usecols)
+
+    # Keep only Campaign, Brand & Name
+    return portfolio_df.rename(columns=rename_dict)[list(rename_dict.values())]
+
+def portfolio_content_hash(data):
+    """Cache key for a parsed portfolio: SHA-256 of the file bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+# --- CAMPAIGN MATCHING ---
+
+NON_ALNUM_RE = r"[^0-9a-z]+"
+FUZZY_THRESHOLD = 0.8      # Minimum trigram Dice similarity for a fuzzy match
+FUZZY_MAX_POSTINGS = 2000  # Trigrams shared by more campaigns than this are too common to help
+FUZZY_CANDIDATES = 10      # Best index candidates re-scored per unmatched name
+FUZZY_AMBIGUITY_MARGIN = 0.05  # A different brand scoring this close to the best makes a fuzzy match ambiguous
+
+def _clean_keys(values):
+    # Same key the original exact merge used: lower-cased, trimmed
+    return pd.Series(values).astype(str).str.lower().str.strip()
+
+def _normalized_keys(clean_keys):
+    # Ignores punctuation and whitespace differences
+    return clean_keys.str.replace(NON_ALNUM_RE, " ", regex=True).str.strip()
+
+def _trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CampaignMatcher:
+    """
+    Prebuilt index over the portfolio Campaign column. Rows are matched in tiers:
+    "exact" (lower/trim, like the original merge), "normalized" (punctuation and
+    whitespace ignored) and "fuzzy" (trigram index, Dice >= FUZZY_THRESHOLD, and no
+    other brand within FUZZY_AMBIGUITY_MARGIN of the best score).
+    Fuzzy lookups only score candidates that share uncommon trigrams, so the cost
+    does not grow with portfolio size x campaign count.
+    """
+
+    def __init__(self, mapping, threshold=FUZZY_THRESHOLD):
+        self.threshold = threshold
+        mapping = mapping.reset_index(drop=True)
+        self.has_name = "Name" in mapping.columns
+        self.brand = mapping["Brand"]
+        self.name = mapping["Name"] if self.has_name else None
+
+        clean = _clean_keys(mapping["Campaign"])
+        normalized = _normalized_keys(clean)
+
+        # First occurrence wins, as with drop_duplicates before the merge
+        self.exact = pd.Series(clean.index, index=clean)
+        self.exact = self.exact[~self.exact.index.duplicated()]
+        self.normalized = pd.Series(normalized.index, index=normalized)
+        self.normalized = self.normalized[~self.normalized.index.duplicated()]
+
+        self.keys = self.normalized.index.to_numpy()
+        self.positions = self.normalized.to_numpy()
+        self.postings = {}
+        for i, key in enumerate(self.keys):
+            for gram in _trigrams(key):
+                self.postings.setdefault(gram, []).append(i)
+
+    def _fuzzy(self, key):
+        grams = _trigrams(key)
+        counts = {}
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None or len(posting) > FUZZY_MAX_POSTINGS:
+                continue
+            for i in posting:
+                counts[i] = counts.get(i, 0) + 1
+
+        scored = []
+        for i in sorted(counts, key=lambda i: (-counts[i], i))[:FUZZY_CANDIDATES]:
+            other = _trigrams(self.keys[i])
+            scored.append((2 * len(grams & other) / (len(grams) + len(other)), -self.positions[i]))
+        if not scored:
+            return None
+        # Highest score wins; ties go to the earliest portfolio row
+        scored.sort(reverse=True)
+        best_score, best = scored[0][0], -scored[0][1]
+        if best_score < self.threshold:
+            return None
+        brand = self.brand.iat[best]
+        for score, position in scored[1:]:
+            if best_score - score > FUZZY_AMBIGUITY_MARGIN:
+                break
+            if self.brand.iat[-position] != brand:
+                return None  # Two brands fit about equally well; leave it unmatched
+        return best
+
+    def match(self, campaigns):
+        """Returns (positions into the mapping as float with NaN for no match, tier per row)."""
+        clean = _clean_keys(campaigns)
+        positions = clean.map(self.exact)
+        tiers = pd.Series(None, index=clean.index, dtype=object)
+        tiers[positions.notna()] = "exact"
+
+        missing = positions.isna()
+        if missing.any():
+            normalized = _normalized_keys(clean[missing])
+            found = normalized.map(self.normalized)
+            positions[missing] = found
+            tiers[found[found.notna()].index] = "normalized"
+
+            still = found[found.isna()].index
+            if len(still):
+                # Each distinct leftover name is looked up once
+                leftovers = normalized[still]
+                fuzzy = {key: self._fuzzy(key) for key in leftovers.unique() if key}
+                found = leftovers.map(fuzzy).astype(float)
+                positions[still] = found
+                tiers[found[found.notna()].index] = "fuzzy"
+
+        return positions.astype(float).to_numpy(), tiers.to_numpy()
+
+def apply_portfolio_mapping(df, mapping):
+    """
+    Adds Brand/Name (and the Match Tier used) from a load_portfolio_mapping() frame
+    or a prebuilt CampaignMatcher onto campaign rows.
+    """
+    matcher = mapping if isinstance(mapping, CampaignMatcher) else CampaignMatcher(mapping)
+    positions, tiers = matcher.match(df["Campaign"].to_numpy())
+
+    df = df.copy(deep=False)  # New columns only; the existing ones are shared
+    df["Brand"] = matcher.brand.reindex(positions).to_numpy()
+    if matcher.has_name:
+        df["Name"] = matcher.name.reindex(positions).to_numpy()
+    df["Match Tier"] = tiers
+    return df
+
+def _compact_column(name, values):
+    if name in CATEGORY_COLUMNS:
+        return pd.Categorical(values)
+    if name == "Invoice date":
+        return pd.to_datetime(values, format="%d-%m-%Y", errors="coerce")
+    if name == "Clicks":
+        return pd.to_numeric(values).astype("int32")
+    return values
+
+def compact_frame(df):
+    """Converts a report frame to compact dtypes in place (already compact columns are left alone)."""
+    for name in df.columns:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(column.dtype):
+            continue
+        converted = _compact_column(name, column)
+        if converted is not column:
+            df[name] = converted
+    return df
+
+def rows_to_frame(rows, compact=False):
+    """
+    Parsed campaign rows (list of dicts, or a frame) as a frame. compact builds it column
+    by column straight into categorical/datetime/narrow int arrays, so the object
+    columns of the plain constructor never exist.
+    """
+    if isinstance(rows, pd.DataFrame):
+        df = pd.DataFrame(rows)  # New frame object over the same data
+        return compact_frame(df) if compact else df
+    if not compact:
+        return pd.DataFrame(rows, columns=ROW_COLUMNS)
+    return pd.DataFrame({
+        name: _compact_column(name, [row[name] for row in rows])
+        for name in ROW_COLUMNS
+    })
+
+def build_master_df(rows, mapping=None, compact=False):
+    """Turns parsed rows into the master report frame (GST column, brand mapping, column order)."""
+    df = rows_to_frame(rows, compact)
+
+    # Add With GST Column
+    df["With GST Amount (18%)"] = df["Amount"] * GST_FACTOR
+
+    if mapping is not None:
+        df = apply_portfolio_mapping(df, mapping)
+        if compact:
+            compact_frame(df)
+
+    columns = [c for c in REPORT_COLUMNS if c in df.columns]
+    return df if list(df.columns) == columns else df[columns]
+
+def concat_reports(frames):
+    """
+    pd.concat for report frames that keeps categorical columns categorical:
+    each frame's categories are widened to the union first (plain concat would
+    fall back to object columns whenever the categories differ).
+    """
+    if len(frames) == 1:
+        return frames[0]
+    if len(frames) > 1:
+        dtypes = {}
+        for name in frames[0].columns:
+            if all(isinstance(f[name].dtype, pd.CategoricalDtype) for f in frames if name in f.columns):
+                categories = frames[0][name].cat.categories
+                for f in frames[1:]:
+                    if name in f.columns:
+                        categories = categories.union(f[name].cat.categories)
+                dtypes[name] = pd.CategoricalDtype(categories)
+        if dtypes:
+            widened = []
+            for f in frames:
+                f = f.copy(deep=False)  # Only the categorical columns are replaced
+                for name, dtype in dtypes.items():
+                    if name in f.columns:
+                        f[name] = f[name].astype(dtype)
+                widened.append(f)
+            frames = widened
+    return pd.concat(frames, ignore_index=True)
+
+BRAND_SUMS = {
+    "Campaign": "count",
+    "Clicks": "sum",
+    "Amount": "sum",
+    "With GST Amount (18%)": "sum"
+}
+
+def aggregate_brands(df):
+    """Per-brand partial sums. Partials from separate chunks can be added together."""
+    return df.groupby("Brand", dropna=False, observed=True).agg(BRAND_SUMS)
+
+def combine_brand_aggregates(partials):
+    """Adds aggregate_brands() partials together into one per-brand frame."""
+    partials = [p for p in partials if not p.empty]
+    if not partials:
+        return aggregate_brands(pd.DataFrame(columns=["Brand", "Campaign", "Clicks", "Amount", "With GST Amount (18%)"]))
+    return pd.concat(partials).groupby(level=0, dropna=False, observed=True).sum()
+
+def finalize_pivot(partials, selected_brands=None):
+    """
+    Combines aggregate_brands() partials into the Pivot Table Report with a Grand Total row,
+    optionally restricted to selected_brands (the same as filtering rows before aggregating).
+    """
+    combined = combine_brand_aggregates(partials)
+    if selected_brands:
+        combined = combined[combined.index.isin(selected_brands)]
+    pivot_df = (
+        combined
+        .reset_index()
+        .rename(columns={
+            "Campaign": "Total Campaigns",
+            "Clicks": "Total Clicks",
+            "Amount": "Total Amount (excl. GST)",
+            "With GST Amount (18%)": "Total Amount (incl. GST)"
+        })
+    )
+    
+    # Sort by total amount
+    pivot_df = pivot_df.sort_values("Total Amount (incl. GST)", ascending=False)
+    
+    # Add Grand Total
+    grand_total = pd.DataFrame({
+        'Brand': ['Grand Total'],
+        'Total Campaigns': [pivot_df['Total Campaigns'].sum()],
+        'Total Clicks': [pivot_df['Total Clicks'].sum()],
+        'Total Amount (excl. GST)': [pivot_df['Total Amount (excl. GST)'].sum()],
+        'Total Amount (incl. GST)': [pivot_df['Total Amount (incl. GST)'].sum()]
+    })
+    return pd.concat([pivot_df, grand_total], ignore_index=True)
+
+# --- BRAND CUBE ---
+
+CUBE_KEYS = ["Brand", "Campaign Type", "Invoice date"]
+
+def aggregate_cube(df, by=None):
+    """
+    Brand x Campaign Type x Invoice date partial sums (same columns as aggregate_brands).
+    Partials add together. by adds an outer grouping key, one value per row (e.g. the
+    file a row came from). A frame without brand mapping groups under a missing Brand.
+    """
+    keys = [
+        df[name] if name in df.columns else pd.Series(None, index=df.index, dtype=object, name=name)
+        for name in CUBE_KEYS
+    ]
+    if by is not None:
+        keys = [by] + keys
+    return df.groupby(keys, dropna=False, observed=True).agg(BRAND_SUMS)
+
+class BrandCube:
+    """
+    Pre-aggregated report data, built once per dataset: aggregate_cube() cells plus the
+    distinct campaign count per brand (a campaign always maps to one brand, so those add
+    up across brands). Metrics and the pivot for any brand selection come from here
+    without touching the row-level frame.
+    """
+
+    def __init__(self, cells, campaigns):
+        self.cells = cells
+        self.campaigns = campaigns
+        self.brand_totals = cells.groupby(level="Brand", dropna=False, observed=True).sum()
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(aggregate_cube(df), distinct_campaigns(df))
+
+    @classmethod
+    def from_partials(cls, partials, df):
+        """Adds aggregate_cube() partials together; df only supplies distinct campaign counts."""
+        partials = [p for p in partials if not p.empty]
+        if not partials:
+            return cls.from_frame(df)
+        cells = pd.concat(partials).groupby(level=list(range(len(CUBE_KEYS))), dropna=False, observed=True).sum()
+        return cls(cells, distinct_campaigns(df))
+
+    def brands(self):
+        return sorted(b for b in self.brand_totals.index if pd.notna(b))
+
+    def metrics(self, selected_brands=None):
+        """Records, Campaigns (distinct), Clicks, Amount and With GST totals for the selection (None = all)."""
+        totals, campaigns = self.brand_totals, self.campaigns
+        if selected_brands is not None:
+            totals = totals[totals.index.isin(selected_brands)]
+            campaigns = campaigns[campaigns.index.isin(selected_brands)]
+        return {
+            "Records": int(totals["Campaign"].sum()),
+            "Campaigns": int(campaigns.sum()),
+            "Clicks": int(totals["Clicks"].sum()),
+            "Amount": float(totals["Amount"].sum()),
+            "With GST": float(totals["With GST Amount (18%)"].sum())
+        }
+
+    def pivot(self, selected_brands=None):
+        """Pivot Table Report, optionally restricted to selected_brands."""
+        return finalize_pivot([self.brand_totals], selected_brands)
+
+def distinct_campaigns(df):
+    brand = df["Brand"] if "Brand" in df.columns else pd.Series(None, index=df.index, dtype=object, name="Brand")
+    return df.groupby(brand, dropna=False, observed=True)["Campaign"].nunique()
+
+# --- PAGED VIEWS ---
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+def search_mask(df, query):
+    """Boolean array: rows with `query` (case-insensitive substring) in any text column."""
+    mask = np.zeros(len(df), dtype=bool)
+    for name in df.columns:
+        values = df[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Match each category once, then pick rows by code
+            hits = values.cat.categories.astype(str).str.contains(query, case=False, regex=False)
+            mask |= np.isin(values.cat.codes.to_numpy(), np.flatnonzero(hits))
+        elif values.dtype == object or pd.api.types.is_string_dtype(values):
+            # Object columns are text with NaN for missing values (e.g. unmatched Brand), which
+            # is_string_dtype() does not count as text; missing values never match
+            hits = values.astype(str).str.contains(query, case=False, regex=False, na=False) & values.notna()
+            mask |= hits.to_numpy(dtype=bool)
+    return mask
+
+def _sort_values(values):
+    # Sort key for a report column: dd-mm-yyyy strings as dates, categories alphabetically
+    if values.name == "Invoice date" and not pd.api.types.is_datetime64_any_dtype(values):
+        return pd.to_datetime(values, format="%d-%m-%Y", errors="coerce")
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.reorder_categories(values.cat.categories.sort_values())
+    return values
+
+class PagedView:
+    """
+    Server-side search, sort and paging over a report frame, so a UI only has to
+    ship the visible page. Matching rows are found once per search and ordered once
+    per sort; paging through them afterwards is a positional slice.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._matches = (None, None)   # (search, row positions)
+        self._order = (None, None)     # ((search, sort_by, ascending), row positions)
+
+    def rows(self, search="", sort_by=None, ascending=True):
+        """Positions of the rows matching `search`, in display order."""
+        key = (search, sort_by, ascending)
+        if self._order[0] == key:
+            return self._order[1]
+        if self._matches[0] != search:
+            positions = np.flatnonzero(search_mask(self.df, search)) if search else np.arange(len(self.df))
+            self._matches = (search, positions)
+        positions = self._matches[1]
+        if sort_by is not None:
+            values = _sort_values(self.df[sort_by].iloc[positions].reset_index(drop=True))
+            order = values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+            positions = positions[order]
+        self._order = (key, positions)
+        return positions
+
+    def page(self, number, size, search="", sort_by=None, ascending=True):
+        """(rows of 1-based page `number`, count of matching rows)."""
+        positions = self.rows(search, sort_by, ascending)
+        start = (number - 1) * size
+        return self.df.iloc[positions[start:start + size]], len(positions)
+
+# --- INCREMENTAL SESSION ---
+
+class IncrementalReport:
+    """
+    Master report for one session that follows the upload set by delta.
+    Files are keyed by identity (e.g. the uploader's file id) and by content hash, so only
+    unseen files are parsed, removed files drop out, and each file keeps its own mapped
+    frame and cube partial - re-uploading a file or adding one more never redoes the rest.
+    With compact=True frames use compact dtypes and the row dicts are dropped once a
+    file's frame is built (a new portfolio re-maps from the frame instead).
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.entries = {}     # file key -> {"name", "hash", "rows", "count", "method", "meta", "frame", "partial", "source"}
+        self.by_hash = {}     # content hash -> file key
+        self.order = []
+        self.matcher_key = None
+        self.master = pd.DataFrame()
+        self.version = 0      # Bumped whenever master changes
+        self._upload_keys = None
+        self._hashes = {}     # file key -> content hash, for files not parsed yet
+        self.archives = {}    # archive key -> (member file keys, skipped entries), once fully read
+        self._cube = None     # (version, BrandCube)
+
+    def pending(self, files):
+        """
+        Takes [(key, name, pdf_bytes)] for the current upload set and returns the
+        [(key, name, pdf_bytes, content_hash)] that still need parsing. Files whose
+        content is already in the session are adopted without parsing.
+        pdf_bytes may be any bytes-like object (e.g. a memoryview over the upload).
+        """
+        upload_keys = [key for key, _, _ in files]
+        if upload_keys != self._upload_keys:
+            # A new upload set: everything parsed so far now counts as from session
+            self._upload_keys = upload_keys
+            for entry in self.entries.values():
+                entry["source"] = "session"
+
+        todo = []
+        for key, name, data in files:
+            if key in self.entries:
+                continue
+            if key not in self._hashes:
+                self._hashes[key] = hashlib.sha256(data).hexdigest()
+            content_hash = self._hashes[key]
+            known = self.entries.get(self.by_hash.get(content_hash))
+            if known is not None:
+                self.entries[key] = {**known, "name": name}
+            else:
+                todo.append((key, name, data, content_hash))
+        return todo
+
+    def add(self, key, name, content_hash, rows, method, meta):
+        """Records a freshly parsed file."""
+        self.entries[key] = {
+            "name": name, "hash": content_hash, "count": len(rows), "method": method, "meta": meta,
+            "rows": rows, "frame": None, "partial": None, "source": "processed"
+        }
+        self.by_hash[content_hash] = key
+
+    def sync(self, keys, mapping=None, mapping_key=None):
+        """
+        Brings the master report in line with the upload set `keys` (in upload order).
+        Only new files are mapped; a different mapping_key re-maps every file from its rows.
+        Files not added yet (still being parsed) are left out until they are.
+        """
+        keys = list(keys)
+        uploaded = set(keys)
+        self._hashes = {k: h for k, h in self._hashes.items() if k in uploaded}
+        keys = [k for k in keys if k in self.entries]
+        current = set(keys)
+        for key in [k for k in self.entries if k not in current]:
+            del self.entries[key]
+        self.by_hash = {h: k for h, k in self.by_hash.items() if k in current}
+        for key, entry in self.entries.items():
+            self.by_hash.setdefault(entry["hash"], key)
+
+        remap = mapping_key != self.matcher_key
+        self.matcher_key = mapping_key
+        todo = [k for k in keys if self.entries[k]["count"] and (remap or self.entries[k]["frame"] is None)]
+        built = self._build(todo, mapping) if todo else None
+
+        if remap or keys != self.order:
+            old = len(self.order)
+            with_rows = [k for k in keys if self.entries[k]["count"]]
+            added = [k for k in keys[old:] if self.entries[k]["count"]]
+            if not with_rows:
+                frames = []
+            elif todo == with_rows:
+                # First load or re-map: the one-pass frame is the master
+                frames = [built]
+            elif not remap and keys[:old] == self.order:
+                # Files only added: append their frames to the existing master
+                frames = [self.master] if not self.master.empty else []
+                frames += [built] if todo == added else [self.entries[k]["frame"] for k in added]
+            else:
+                frames = [self.entries[k]["frame"] for k in with_rows]
+            self.master = concat_reports(frames) if frames else pd.DataFrame()
+            self.version += 1
+        self.order = keys
+        return self.master
+
+    def _build(self, keys, mapping):
+        """Maps the given files in one pass, then slices the result back into per-file frames and cube partials."""
+        sources = []
+        for key in keys:
+            entry = self.entries[key]
+            source = entry["rows"]
+            if source is None:
+                source = entry["frame"].drop(columns=MAPPING_COLUMNS, errors="ignore")
+            sources.append(source)
+        if all(isinstance(source, list) for source in sources):
+            combined = [row for rows in sources for row in rows]
+        else:
+            combined = concat_reports([rows_to_frame(source, self.compact) for source in sources])
+        df = build_master_df(combined, mapping, self.compact)
+
+        counts = [self.entries[k]["count"] for k in keys]
+        partials = {}
+        file_positions = pd.RangeIndex(len(keys)).repeat(counts)
+        for position, partial in aggregate_cube(df, by=file_positions).groupby(level=0):
+            partials[position] = partial.droplevel(0)
+
+        start = 0
+        for position, (key, count) in enumerate(zip(keys, counts)):
+            entry = self.entries[key]
+            entry["frame"] = df.iloc[start:start + count]
+            entry["partial"] = partials.get(position)
+            if self.compact:
+                entry["rows"] = None
+            start += count
+        return df
+
+    def status(self):
+        """Processing report rows for the current upload set."""
+        return [
+            {
+                "File": entry["name"],
+                "Status": entry["method"],
+                "Rows": entry["count"],
+                "Layout": entry["meta"].get("layout") or "-",
+                "Reconciled": entry["meta"].get("reconciliation") or "-",
+                "Difference": entry["meta"].get("difference"),
+                "Time (s)": (entry["meta"].get("timing") or {}).get("wall"),
+                "Source": "from session" if entry["source"] == "session" else "newly processed"
+            }
+            for entry in (self.entries[k] for k in self.order)
+        ]
+
+    def reconciliation(self):
+        """reconcile() over the current upload set, one row per file with rows."""
+        return reconcile([
+            (entry["name"], frame["Invoice Number"].iloc[0], len(frame), frame["Amount"].sum(),
+             frame["Total Amount (tax included)"].iloc[0])
+            for entry, frame in ((self.entries[k], self.entries[k]["frame"]) for k in self.order)
+            if frame is not None and len(frame)
+        ])
+
+    def timings(self):
+        """timing_report() over the current upload set."""
+        return timing_report([(self.entries[k]["name"], self.entries[k]["meta"].get("timing")) for k in self.order])
+
+    def cube(self):
+        """BrandCube for the current master, summed from the per-file partials once per version."""
+        if self._cube is None or self._cube[0] != self.version:
+            partials = [self.entries[k]["partial"] for k in self.order if self.entries[k]["partial"] is not None]
+            self._cube = (self.version, BrandCube.from_partials(partials, self.master))
+        return self._cube[1]
+
+# --- HISTORY STORE ---
+
+HISTORY_PATH = os.environ.get("INVOICE_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".invoice_history.sqlite"))
+
+# Store column -> campaign row key, in row order
+HISTORY_ROW_COLUMNS = [
+    ("campaign", "Campaign"),
+    ("campaign_type", "Campaign Type"),
+    ("clicks", "Clicks"),
+    ("average_cpc", "Average CPC"),
+    ("amount", "Amount"),
+    ("invoice_number", "Invoice Number"),
+    ("invoice_date", "Invoice date"),
+    ("total", "Total Amount (tax included)"),
+]
+
+def _iso_date(invoice_date):
+    """'dd-mm-yyyy' as extracted -> 'yyyy-mm-dd' (sortable), None when missing."""
+    try:
+        return datetime.strptime(invoice_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+class InvoiceStore:
+    """
+    Embedded SQLite history of extracted campaign rows, one invoice per content hash.
+    An invoice whose content hash or Invoice Number is already stored is ignored on
+    ingest, so overlapping monthly uploads never double count. Rows are indexed by
+    invoice date for range queries.
+    """
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    content_hash TEXT PRIMARY KEY,
+                    invoice_number TEXT,
+                    invoice_date TEXT,
+                    file_name TEXT,
+                    ingested_at TEXT
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS invoices_number
+                    ON invoices (invoice_number) WHERE invoice_number IS NOT NULL;
+                CREATE TABLE IF NOT EXISTS rows (
+                    content_hash TEXT NOT NULL REFERENCES invoices (content_hash),
+                    iso_date TEXT,
+                    campaign TEXT,
+                    campaign_type TEXT,
+                    clicks INTEGER,
+                    average_cpc REAL,
+                    amount REAL,
+                    invoice_number TEXT,
+                    invoice_date TEXT,
+                    total REAL
+                );
+                CREATE INDEX IF NOT EXISTS rows_date ON rows (iso_date);
+            """)
+
+    def _connect(self):
+        # A connection per call keeps the store usable from any Streamlit session thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def ingest(self, file_name, content_hash, rows):
+        """Stores one invoice's campaign rows. Returns False if it was already stored."""
+        if not rows:
+            return False
+        number = rows[0]["Invoice Number"]
+        number = None if number in (None, "N/A") else number
+        iso_date = _iso_date(rows[0]["Invoice date"])
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO invoices VALUES (?, ?, ?, ?, ?)",
+                (content_hash, number, iso_date, file_name, datetime.now().isoformat(timespec="seconds"))
+            )
+            if cur.rowcount == 0:
+                return False
+            conn.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(content_hash, iso_date) + tuple(row[key] for _, key in HISTORY_ROW_COLUMNS) for row in rows]
+            )
+        return True
+
+    def summary(self):
+        """(invoice count, row count, first date, last date); dates are datetime.date or None."""
+        with self._connect() as conn:
+            invoices, first, last = conn.execute(
+                "SELECT COUNT(*), MIN(invoice_date), MAX(invoice_date) FROM invoices"
+            ).fetchone()
+            row_count = conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        to_date = lambda d: datetime.strptime(d, "%Y-%m-%d").date() if d else None
+        return invoices, row_count, to_date(first), to_date(last)
+
+    @staticmethod
+    def _date_range(start, end):
+        # (" WHERE ..." or "", params) selecting rows dated start..end inclusive
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("iso_date >= ?")
+            params.append(start.strftime("%Y-%m-%d"))
+        if end is not None:
+            clauses.append("iso_date <= ?")
+            params.append(end.strftime("%Y-%m-%d"))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, start=None, end=None):
+        """
+        Campaign rows as a frame (parsed row columns) for invoices dated start..end inclusive,
+        in invoice date order. Undated invoices are only returned without a range.
+        """
+        where, params = self._date_range(start, end)
+        sql = "SELECT " + ", ".join(col for col, _ in HISTORY_ROW_COLUMNS) + " FROM rows" + where + " ORDER BY iso_date, rowid"
+        with self._connect() as conn:
+            records = conn.execute(sql, params).fetchall()
+        return pd.DataFrame.from_records(records, columns=[key for _, key in HISTORY_ROW_COLUMNS])
+
+    def reconciliation(self, start=None, end=None):
+        """reconcile() for the invoices query() returns, one row per stored file, summed in SQL."""
+        where, params = self._date_range(start, end)
+        sql = (
+            "SELECT invoices.file_name, MIN(rows.invoice_number), COUNT(*), SUM(rows.amount), MIN(rows.total)"
+            " FROM rows JOIN invoices USING (content_hash)" + where +
+            " GROUP BY content_hash ORDER BY MIN(rows.iso_date), MIN(rows.rowid)"
+        )
+        with self._connect() as conn:
+            return reconcile(conn.execute(sql, params).fetchall())
+
+# --- EXPORT ---
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def iter_df_rows(df):
+    """Plain row tuples for the workbook writer, with NaN/None as blank cells."""
+    for row in df.itertuples(index=False, name=None):
+        yield tuple(None if v is None or v is pd.NaT or (isinstance(v, float) and v != v) else v for v in row)
+
+def write_excel_workbook(output, sheets):
+    """
+    Writes [(sheet_name, columns, rows), ...] into one workbook. `rows` is any iterable
+    of row sequences and is consumed once, top to bottom; xlsxwriter's constant_memory
+    mode flushes each row to disk so the workbook never sits in memory as cell objects.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True})
+    date_format = workbook.add_format({"num_format": "dd-mm-yyyy"})
+    for sheet_name, columns, rows in sheets:
+        worksheet = workbook.add_worksheet(sheet_name[:31])
+        worksheet.write_row(0, 0, list(columns), header_format)
+        for r, row in enumerate(rows, start=1):
+            for c, value in enumerate(row):
+                if isinstance(value, datetime):
+                    worksheet.write_datetime(r, c, value, date_format)
+                elif value is not None:
+                    worksheet.write(r, c, value)
+    workbook.close()
+    return output
+
+def export_reports_excel(master_df, filtered_df=None, pivot_df=None):
+    """Master, Filtered and Pivot as one .xlsx workbook (bytes)."""
+    sheets = [("Master Report", master_df.columns, iter_df_rows(master_df))]
+    if filtered_df is not None:
+        sheets.append(("Filtered Report", filtered_df.columns, iter_df_rows(filtered_df)))
+    if pivot_df is not None:
+        sheets.append(("Pivot Table", pivot_df.columns, iter_df_rows(pivot_df)))
+    return write_excel_workbook(io.BytesIO(), sheets).getvalue()
+
+def export_csv(df):
+    return df.to_csv(index=False).encode("utf-8")
+
+def export_parquet(df):
+    """Parquet bytes; needs pyarrow (installed with Streamlit) or fastparquet."""
+    output = io.BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()